@@ -2,6 +2,8 @@ import bpy
 from bpy.props import *
 
 from . import addon_updater_ops
+from . import globs
+from .utils.images import decoded_images
 
 
 class CombineList(bpy.types.PropertyGroup):
@@ -65,6 +67,10 @@ class UpdatePreferences(bpy.types.AddonPreferences):
         addon_updater_ops.update_settings_ui(self, context)
 
 
+def _update_image_cache_size(self: bpy.types.Scene, context: bpy.types.Context) -> None:
+    decoded_images.set_budget(self.smc_image_cache_size * 1024 * 1024)
+
+
 def register() -> None:
     bpy.types.Scene.smc_ob_data = CollectionProperty(type=CombineList)
     bpy.types.Scene.smc_ob_data_id = IntProperty(default=0)
@@ -125,10 +131,84 @@ def register() -> None:
         default=0,
         options={'HIDDEN'},
     )
+    bpy.types.Scene.smc_prefetch_limit = IntProperty(
+        name='Images decoded in parallel',
+        description='Select how many images are decoded ahead of being copied into the atlas.'
+                    '\nHigher values are faster on many-core machines but use more memory',
+        min=1,
+        max=64,
+        step=1,
+        default=8,
+    )
+    bpy.types.Scene.smc_image_cache_size = IntProperty(
+        name='Decoded image cache (MB)',
+        description='Select how much memory decoded images may keep between atlas runs.'
+                    '\nSet to 0 to decode every image again',
+        min=0,
+        max=65536,
+        step=1,
+        default=256,
+        update=_update_image_cache_size,
+    )
     bpy.types.Scene.smc_save_path = StringProperty(
         description='Select the directory in which the generated texture atlas will be saved',
         default='',
     )
+    bpy.types.Scene.smc_layout_cache = StringProperty(
+        default='',
+        options={'HIDDEN'},
+    )
+    bpy.types.Scene.smc_packer = EnumProperty(
+        name='Packer',
+        items=[
+            ('BINARY_TREE', 'Binary Tree', 'Growing binary tree packer'),
+            ('MAXRECTS_BSSF', 'MaxRects Short Side', 'MaxRects packer placing images by best short side fit'),
+            ('MAXRECTS_BAF', 'MaxRects Area', 'MaxRects packer placing images by best area fit'),
+            ('MAXRECTS_BL', 'MaxRects Bottom Left', 'MaxRects packer placing images by bottom-left rule'),
+            ('SEARCH', 'Best Fit Search', 'Try every packer with several image orders and keep the smallest atlas'),
+            ('PO2_SEARCH', 'Power of 2 Search', 'Try power of 2 atlas sizes from the smallest area up and keep the first one that fits'),
+        ],
+        description='Select the algorithm used to arrange images in the atlas.'
+                    '\nMaxRects leaves less empty space with images of mixed aspect ratios',
+        default='BINARY_TREE',
+    )
+    bpy.types.Scene.smc_rotate = BoolProperty(
+        name='Allow image rotation',
+        description='Allow the packer to turn images by 90 degrees when it makes the atlas smaller.'
+                    '\nUVs are rotated to match',
+        default=False,
+    )
+    bpy.types.Scene.smc_islands = BoolProperty(
+        name='Pack UV islands',
+        description='Only copy the parts of each texture that UV islands use instead of the whole image.'
+                    '\nSingle-page atlases only, pages and UDIM tiles always use whole images',
+        default=False,
+    )
+    bpy.types.Scene.smc_island_repeats = BoolProperty(
+        name='Minimize UV repeats',
+        description='Move UV islands by whole texture repeats so that each material needs fewer repeats in the atlas.'
+                    '\nThe texture is shifted to match, islands wider than one repeat are reported',
+        default=False,
+    )
+    bpy.types.Scene.smc_pages = EnumProperty(
+        name='Overflow',
+        items=[
+            ('OFF', 'Off', 'Fail when the atlas is larger than the page size'),
+            ('PAGES', 'Pages', 'Split the atlas into several images with one material per page'),
+        ] + ([
+            ('UDIM', 'UDIM', 'Split the atlas into UDIM tiles of a single image'),
+        ] if globs.is_blender_2_82_or_newer else []),
+        description='Select what happens when the atlas does not fit into one page',
+        default='OFF',
+    )
+    bpy.types.Scene.smc_page_size = IntProperty(
+        name='Page size (px)',
+        description='Select the width and height of each atlas page',
+        min=256,
+        max=16384,
+        step=1,
+        default=4096,
+    )
 
     ### Sable Tweaks
     bpy.types.Scene.smc_sable_outfit_texture_name = StringProperty(
@@ -209,6 +289,12 @@ def register() -> None:
         description='Merge by Distance Weight. Set to 0 if no merging is wanted',
         default=0.00005,
     )
+    bpy.types.Scene.smc_sable_incremental = BoolProperty(
+        name='Incremental Atlas Update',
+        description='Reuse the previous atlas layout and only redraw new or changed materials.'
+                    '\nFalls back to a full rebuild when they do not fit',
+        default=False,
+    )
     ###
 
     bpy.types.Material.root_mat = PointerProperty(
@@ -256,6 +342,15 @@ def unregister() -> None:
     del bpy.types.Scene.smc_diffuse_size
     del bpy.types.Scene.smc_gaps
     del bpy.types.Scene.smc_save_path
+    del bpy.types.Scene.smc_prefetch_limit
+    del bpy.types.Scene.smc_image_cache_size
+    del bpy.types.Scene.smc_layout_cache
+    del bpy.types.Scene.smc_packer
+    del bpy.types.Scene.smc_rotate
+    del bpy.types.Scene.smc_islands
+    del bpy.types.Scene.smc_island_repeats
+    del bpy.types.Scene.smc_pages
+    del bpy.types.Scene.smc_page_size
 
     ### Sable Tweaks
     del bpy.types.Scene.smc_sable_outfit_texture_name
@@ -272,6 +367,7 @@ def unregister() -> None:
     del bpy.types.Scene.smc_sable_create_transparents_texture    
 
     del bpy.types.Scene.smc_sable_merge_by_distance_weight
+    del bpy.types.Scene.smc_sable_incremental
     ###
 
     del bpy.types.Material.root_mat
@@ -14,6 +14,8 @@ except ImportError:
 
 is_blender_2_79_or_older = bpy.app.version < (2, 80, 0)
 is_blender_2_80_or_newer = bpy.app.version >= (2, 80, 0)
+is_blender_2_82_or_newer = bpy.app.version >= (2, 82, 0)
+is_blender_2_83_or_newer = bpy.app.version >= (2, 83, 0)
 is_blender_2_92_or_newer = bpy.app.version >= (2, 92, 0)
 is_blender_3_or_newer = bpy.app.version >= (3, 0, 0)
 
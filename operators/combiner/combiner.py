@@ -3,6 +3,7 @@ from bpy.props import *
 
 from .combiner_ops import *
 from .packer import BinPacker, SableBinPacker
+from ...utils.images import decoded_images
 from ... import globs
 
 
@@ -24,17 +25,28 @@ class Combiner(bpy.types.Operator):
             self.invoke(context, None)
         scn = context.scene
         scn.smc_save_path = self.directory
-        self.structure = BinPacker(get_size(scn, self.structure)).fit()
-
-        size = get_atlas_size(self.structure)
+        if scn.smc_island_repeats:
+            repeats = normalize_uv_islands(scn, self.structure, self.mats_uv)
+            if repeats:
+                self.report({'INFO'}, '{0} UV islands need texture repeats: {1}'.format(
+                    sum(repeats.values()), ', '.join(sorted(repeats))))
+        self.structure = get_size(scn, self.structure)
+        tiles = split_uv_islands(scn, self.structure, self.mats_uv) if scn.smc_islands else self.structure
+        tiles = fit_images(scn, BinPacker, tiles)
+
+        size = get_atlas_size(tiles)
         atlas_size = calculate_adjusted_size(scn, size)
 
+        if scn.smc_pages != 'OFF' and max(atlas_size, default=0) > scn.smc_page_size:
+            return self._execute_pages(scn)
+
         if max(atlas_size, default=0) > 20000:
             self.report({'ERROR'}, 'The output image size of {0}x{1}px is too large'.format(*atlas_size))
             return {'FINISHED'}
 
-        atlas = get_atlas(scn, self.structure, atlas_size)
-        align_uvs(scn, self.structure, atlas.size, size)
+        atlas = get_atlas(scn, tiles, atlas_size)
+        align_uvs(scn, tiles, atlas.size, size)
+        set_mats_uv(scn, self.mats_uv)
         comb_mats = get_comb_mats(scn, atlas, self.mats_uv)
         assign_comb_mats(scn, self.data, comb_mats)
         clear_mats(scn, self.mats_uv)
@@ -42,9 +54,27 @@ class Combiner(bpy.types.Operator):
         self.report({'INFO'}, 'Materials were combined')
         return {'FINISHED'}
 
+    def _execute_pages(self, scn: Scene) -> Set[str]:
+        oversized_size = get_oversized_image_size(scn, self.structure)
+        if oversized_size:
+            self.report({'ERROR'}, 'The image size of {0}x{1}px is larger than the page size'.format(*oversized_size))
+            return {'FINISHED'}
+
+        self.structure = get_page_packer(scn)(self.structure).fit()
+        page_data = get_page_data(scn, self.data, self.mats_uv, self.structure)
+        comb_mats = get_comb_mats_pages(scn, self.structure, page_data)
+        set_mats_uv(scn, self.mats_uv)
+        assign_comb_mats(scn, page_data, comb_mats)
+        clear_mats(scn, self.mats_uv)
+        bpy.ops.smc.refresh_ob_data()
+        self.report({'INFO'}, 'Materials were combined into {0} pages'.format(len(get_pages(self.structure))))
+        return {'FINISHED'}
+
     def invoke(self, context: bpy.types.Context, event: bpy.types.Event) -> Set[str]:
         scn = context.scene
         bpy.ops.smc.refresh_ob_data()
+        clear_poly_index()
+        decoded_images.set_budget(scn.smc_image_cache_size * 1024 * 1024)
 
         if self.cats:
             scn.smc_size = 'PO2'
@@ -180,6 +210,8 @@ class Combiner_Sable(bpy.types.Operator):
         errors = ""
 
         bpy.ops.smc.refresh_ob_data()
+        clear_poly_index()
+        decoded_images.set_budget(scn.smc_image_cache_size * 1024 * 1024)
 
         #scn.smc_size = 'PO2'
         #scn.smc_gaps = 0
@@ -413,8 +445,20 @@ class Combiner_Sable(bpy.types.Operator):
                 #self.report({'ERROR'}, "Atlas " + current_category + " is empty")
                 continue
 
-            structure = get_structure_sable(scn, current_materials, self.mats_uv)
-            fittedStructure = SableBinPacker(get_size_sable(scn, structure)).fit()
+            structure = get_size_sable(scn, get_structure_sable(scn, current_materials, self.mats_uv))
+            incremental = can_update_incrementally_sable(scn, create_atlas)
+
+            atlas = get_incremental_atlas_sable(scn, structure, atlas_name) if incremental and scn.smc_sable_incremental else None
+            if atlas:
+                align_uvs_sable(scn, structure, atlas_name, atlas.size, atlas.size)
+                atlas_material = create_atlas_material_sable(scn, atlas, self.mats_uv, atlas_name, create_atlas)
+                assign_atlased_material_sable(scn, current_materials, atlas_material)
+                save_layout_sable(scn, structure, atlas_name, atlas.size)
+
+                print('Updated ' + current_category + ' materials in ' + atlas_name + '!')
+                continue
+
+            fittedStructure = fit_images(scn, SableBinPacker, structure)
             #fittedStructure = None
             #if current_category == "Outfit":
             #    fittedStructure = SableBinPacker(get_size_sable(scn, structure)).fit()
@@ -424,6 +468,21 @@ class Combiner_Sable(bpy.types.Operator):
             size = get_atlas_size(fittedStructure)
             atlas_size = calculate_adjusted_size(scn, size)
 
+            if scn.smc_pages != 'OFF' and max(atlas_size, default=0) > scn.smc_page_size:
+                oversized_size = get_oversized_image_size(scn, fittedStructure)
+                if oversized_size:
+                    if errors:
+                        errors += '\n'
+                    errors += 'The image size of {0}x{1}px is larger than the page size'.format(*oversized_size)
+                    continue
+
+                fittedStructure = get_page_packer(scn)(fittedStructure).fit()
+                page_materials = create_atlas_page_materials_sable(scn, fittedStructure, atlas_name, create_atlas)
+                assign_atlased_page_materials_sable(scn, current_materials, fittedStructure, page_materials)
+
+                print('Merged ' + current_category + ' materials and created ' + atlas_name + ' in ' + str(len(page_materials)) + ' pages!')
+                continue
+
             if max(atlas_size, default=0) > 20000:
                 #self.report({'ERROR'}, 'The output image size of {0}x{1}px is too large'.format(*atlas_size))
                 if errors:
@@ -435,10 +494,13 @@ class Combiner_Sable(bpy.types.Operator):
             align_uvs_sable(scn, fittedStructure, atlas_name, atlas.size, size)
             atlas_material = create_atlas_material_sable(scn, atlas, self.mats_uv, atlas_name, create_atlas)
             assign_atlased_material_sable(scn, current_materials, atlas_material)
+            if incremental and scn.smc_sable_incremental:
+                save_layout_sable(scn, fittedStructure, atlas_name, atlas.size)
 
             #self.report({'INFO'}, 'Merged ' + current_category + ' materials and created ' + atlas_name + '!')
             print('Merged ' + current_category + ' materials and created ' + atlas_name + '!')
 
+        set_mats_uv(scn, self.mats_uv)
         clear_mats_sable(scn, self.mats_uv, self.sableSeperateMeshedMaterials)
         bpy.ops.smc.refresh_ob_data()
 
@@ -526,6 +588,8 @@ class Combiner_Sable(bpy.types.Operator):
                     bpy.ops.object.mode_set(mode='OBJECT')
 
 
+        print('Decoded image cache: {hits} hits, {misses} misses, {evictions} evictions, {images} images in {bytes} bytes'.format(**decoded_images.get_stats()))
+
         if errors:
             self.report({'ERROR'}, errors)
         else:
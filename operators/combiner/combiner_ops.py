@@ -1,13 +1,19 @@
-import io
+import hashlib
 import itertools
+import json
 import math
 import os
 import random
 import re
 from collections import OrderedDict
 from collections import defaultdict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import chain
+from typing import Callable
 from typing import Dict
+from typing import Iterable
 from typing import List
 from typing import Sequence
 from typing import Set
@@ -18,9 +24,16 @@ from typing import cast
 import bpy
 import numpy as np
 
+from .packer import BinPacker
+from .packer import MaxRectsPacker
+from .packer import PagePacker
+from .packer import PowerOfTwoPacker
+from .packer import SableBinPacker
+from .packer import SearchPacker
 from ... import globs
 from ...type_annotations import CombMats
 from ...type_annotations import Diffuse
+from ...type_annotations import ImageSource
 from ...type_annotations import MatsUV
 from ...type_annotations import ObMats
 from ...type_annotations import SMCObData
@@ -28,15 +41,30 @@ from ...type_annotations import SMCObDataItem
 from ...type_annotations import Scene
 from ...type_annotations import Structure
 from ...type_annotations import StructureItem
+from ...type_annotations import UVLoops
+from ...utils.images import decoded_images
+from ...utils.images import get_content_hashes
+from ...utils.images import get_decoded_image
 from ...utils.images import get_image
-from ...utils.images import get_packed_file
+from ...utils.images import get_image_size
+from ...utils.images import get_source_image
+from ...utils.images import is_jpeg
+from ...utils.images import read_image_source
+from ...utils.islands import get_uv_islands
+from ...utils.islands import merge_rects
 from ...utils.materials import get_diffuse
 from ...utils.materials import get_shader_type
 from ...utils.materials import shader_image_nodes
 from ...utils.materials import sort_materials
 from ...utils.objects import align_uv
+from ...utils.objects import clear_poly_index
+from ...utils.objects import get_loop_indices
+from ...utils.objects import get_loop_topology
+from ...utils.objects import get_poly_loops
 from ...utils.objects import get_polys
-from ...utils.objects import get_uv
+from ...utils.objects import get_uv_data
+from ...utils.objects import remap_material_index
+from ...utils.objects import set_uv_data
 from ...utils.textures import get_texture
 
 try:
@@ -47,11 +75,6 @@ except ImportError:
     Image = None
     ImageType = None
 
-try:
-    from PIL import ImageChops
-except ImportError:
-    ImageChops = None
-
 try:
     from PIL import ImageFile
 except ImportError:
@@ -63,6 +86,8 @@ if Image:
         resampling = Image.LANCZOS
     except AttributeError:
         resampling = Image.ANTIALIAS
+    # Pillow 7+ shrinks by whole factors first when the source is much larger than the tile
+    resize_options = {'reducing_gap': 3.0} if hasattr(Image.Image, 'reduce') else {}
 
 if ImageFile:
     ImageFile.LOAD_TRUNCATED_IMAGES = True
@@ -70,6 +95,8 @@ if ImageFile:
 atlas_prefix = 'Atlas_'
 atlas_texture_prefix = 'texture_atlas_'
 atlas_material_prefix = 'material_atlas_'
+layout_cache_size = 8
+island_area_ratio = 0.9
 
 
 def set_ob_mode(scn: Scene, data: SMCObData) -> None:
@@ -91,15 +118,29 @@ def get_mats_uv(scn: Scene, data: SMCObData) -> MatsUV:
     mats_uv = defaultdict(lambda: defaultdict(list))
     for ob_n, item in data.items():
         ob = scn.objects[ob_n]
-        for idx, polys in get_polys(ob).items():
-            mat = ob.data.materials[idx]
-            if mat not in item:
-                continue
-            for poly in polys:
-                mats_uv[ob_n][mat].extend(align_uv(get_uv(ob, poly)))
+        uv_data = get_uv_data(ob)
+        poly_loops = [
+            (ob.data.materials[idx], loop_start, loop_total)
+            for idx, (loop_start, loop_total) in get_poly_loops(ob).items()
+            if ob.data.materials[idx] in item
+        ]
+        if not poly_loops:
+            continue
+
+        _, loop_start, loop_total = zip(*poly_loops)
+        align_uv(uv_data, np.concatenate(loop_start), np.concatenate(loop_total))
+        for mat, loop_start, loop_total in poly_loops:
+            mats_uv[ob_n][mat].append((uv_data, get_loop_indices(loop_start, loop_total)))
     return mats_uv
 
 
+def set_mats_uv(scn: Scene, mats_uv: MatsUV) -> None:
+    for ob_n, item in mats_uv.items():
+        uv_data = next((uv_data for uv_loops in item.values() for uv_data, _ in uv_loops), None)
+        if uv_data is not None:
+            set_uv_data(scn.objects[ob_n], uv_data)
+
+
 def clear_empty_mats(scn: Scene, data: SMCObData, mats_uv: MatsUV) -> None:
     for ob_n, item in data.items():
         ob = scn.objects[ob_n]
@@ -116,6 +157,7 @@ def _delete_material(ob: bpy.types.Object, mat_name: str) -> None:
             ob_mats.pop(index=mat_idx)
         else:
             ob_mats.pop(index=mat_idx, update_data=True)
+        clear_poly_index(ob)
 
 
 def get_duplicates(mats_uv: MatsUV) -> None:
@@ -161,17 +203,76 @@ def clear_duplicates(scn: Scene, data: Structure) -> None:
                 _delete_material(ob, dup_name)
 
 
+def normalize_uv_islands(scn: Scene, data: Structure, mats_uv: MatsUV) -> Dict[str, int]:
+    uv_obs = _get_uv_obs(mats_uv)
+    repeats = {}
+
+    for mat, item in data.items():
+        img = _get_image(mat)
+        if not item['uv'] or not get_source_image(img):
+            continue
+
+        item_islands = _get_item_islands(scn, item, uv_obs)
+        bounds = [_get_island_bounds(uv_data, islands) for uv_data, islands in item_islands]
+        uv_min = np.concatenate([island_min for island_min, _ in bounds])
+        uv_max = np.concatenate([island_max for _, island_max in bounds])
+        repeat_count = int(np.count_nonzero((uv_max - uv_min > 1).any(axis=1)))
+        if repeat_count:
+            repeats[mat.name] = repeat_count
+
+        # The origin is snapped to the pixel grid, so the texture can be rolled by whole pixels
+        img_size = np.array(_get_image_size(mat, img))
+        origin = np.floor(_get_uv_origin(uv_min, uv_max) * img_size) / img_size
+        shifts = np.ceil(origin - uv_min)
+        extent = (uv_max + shifts).max(axis=0) - origin
+        current_extent = uv_max.max(axis=0)
+        origin = np.where(_get_uv_extent_size(scn, extent) < _get_uv_extent_size(scn, current_extent), origin, 0)
+        if not origin.any():
+            continue
+
+        shifts = iter(np.ceil(origin - uv_min) - origin)
+        for uv_data, islands in item_islands:
+            for loops in islands:
+                uv_data[loops] += next(shifts)
+        item['gfx']['uv_offset'] = tuple(origin.tolist())
+
+    return repeats
+
+
+def _get_uv_origin(uv_min: np.ndarray, uv_max: np.ndarray) -> np.ndarray:
+    # Islands only move by whole tiles, so the tightest tile origin is at the fractional start of one of them.
+    # With islands sorted by that start, the ones before the origin move up by one tile.
+    start = uv_min - np.floor(uv_min)
+    end = start + uv_max - uv_min
+    origin = np.zeros(2)
+
+    for axis in range(2):
+        order = np.argsort(start[:, axis], kind='stable')
+        axis_start = start[order, axis]
+        axis_end = end[order, axis]
+        later = np.maximum.accumulate(axis_end[::-1])[::-1]
+        earlier = np.concatenate(((-np.inf,), np.maximum.accumulate(axis_end)[:-1] + 1))
+        origin[axis] = axis_start[np.argmin(np.maximum(later, earlier) - axis_start)]
+
+    return origin
+
+
+def _get_uv_extent_size(scn: Scene, extent: np.ndarray) -> np.ndarray:
+    extent = np.clip(extent, 1, 25)
+    return extent if scn.smc_crop else np.ceil(extent)
+
+
 def get_size(scn: Scene, data: Structure) -> Dict:
     for mat, item in data.items():
         img = _get_image(mat)
-        packed_file = get_packed_file(img)
+        source_image = get_source_image(img)
         max_x, max_y = _get_max_uv_coordinates(item['uv'])
         item['gfx']['uv_size'] = (np.clip(max_x, 1, 25), np.clip(max_y, 1, 25))
 
         if not scn.smc_crop:
             item['gfx']['uv_size'] = tuple(math.ceil(x) for x in item['gfx']['uv_size'])
 
-        if packed_file:
+        if source_image:
             img_size = _get_image_size(mat, img)
             item['gfx']['size'] = _calculate_size(img_size, item['gfx']['uv_size'], scn.smc_gaps)
         else:
@@ -180,6 +281,110 @@ def get_size(scn: Scene, data: Structure) -> Dict:
     return OrderedDict(sorted(data.items(), key=_size_sorting, reverse=True))
 
 
+def split_uv_islands(scn: Scene, data: Structure, mats_uv: MatsUV) -> Structure:
+    uv_obs = _get_uv_obs(mats_uv)
+    structure = {}
+
+    for mat, item in data.items():
+        islands = _get_island_tiles(scn, mat, item, uv_obs)
+        if not islands:
+            structure[mat] = item
+            continue
+
+        for idx, island in enumerate(islands):
+            structure[(mat, idx)] = island
+
+    return OrderedDict(sorted(structure.items(), key=_size_sorting, reverse=True))
+
+
+def _get_island_tiles(scn: Scene, mat: bpy.types.Material, item: StructureItem,
+                      uv_obs: Dict[int, str]) -> Union[List[StructureItem], None]:
+    img = _get_image(mat)
+    if tuple(item['gfx']['uv_size']) != (1, 1) or 'uv_offset' in item['gfx'] or not get_source_image(img):
+        return None
+
+    width, height = _get_image_size(mat, img)
+    padding = 0 if scn.smc_pixel_art else 1
+    rects = []
+    island_loops = []
+
+    for uv_data, islands in _get_item_islands(scn, item, uv_obs):
+        uv_min, uv_max = _get_island_bounds(uv_data, islands)
+        rects.append(np.column_stack((
+            np.floor(uv_min[:, 0] * width) - padding,
+            np.floor((1 - uv_max[:, 1]) * height) - padding,
+            np.ceil(uv_max[:, 0] * width) + padding,
+            np.ceil((1 - uv_min[:, 1]) * height) + padding,
+        )))
+        island_loops.extend((uv_data, island) for island in islands)
+
+    if not rects:
+        return None
+
+    rects = np.concatenate(rects).astype(int)
+    rects[:, :2] = np.clip(rects[:, :2], 0, (width - 1, height - 1))
+    rects[:, 2:] = np.clip(rects[:, 2:], rects[:, :2] + 1, (width, height))
+    rects, rect_ids = merge_rects(rects)
+    if ((rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])).sum() >= island_area_ratio * width * height:
+        return None
+
+    tiles = []
+    for rect_id, (x0, y0, x1, y1) in enumerate(rects.tolist()):
+        uv_loops = defaultdict(list)
+        for (uv_data, loops), island_rect_id in zip(island_loops, rect_ids):
+            if island_rect_id == rect_id:
+                uv_loops[id(uv_data)].append((uv_data, loops))
+
+        tiles.append({
+            'gfx': {
+                'img_or_color': None,
+                'size': (x1 - x0 + scn.smc_gaps, y1 - y0 + scn.smc_gaps),
+                'uv_size': (1, 1),
+                'crop': (x0, y0, x1, y1),
+                'crop_uv': (x0 / width, 1 - y1 / height, (x1 - x0) / width, (y1 - y0) / height),
+            },
+            'dup': [],
+            'ob': item['ob'],
+            'uv': [(entries[0][0], np.concatenate([loops for _, loops in entries])) for entries in uv_loops.values()],
+            'mat': mat,
+        })
+
+    return tiles
+
+
+def _get_uv_obs(mats_uv: MatsUV) -> Dict[int, str]:
+    return {
+        id(uv_data): ob_n
+        for ob_n, item in mats_uv.items()
+        for uv_loops in item.values()
+        for uv_data, _ in uv_loops
+    }
+
+
+def _get_item_islands(scn: Scene, item: StructureItem,
+                      uv_obs: Dict[int, str]) -> List[Tuple[np.ndarray, List[np.ndarray]]]:
+    # Moving islands by whole tiles keeps them connected, so the labels are extracted once per material
+    if 'islands' not in item:
+        item['islands'] = [
+            (uv_data, _get_islands(scn.objects[uv_obs[id(uv_data)]], uv_data, loops))
+            for uv_data, loops in item['uv']
+        ]
+    return item['islands']
+
+
+def _get_islands(ob: bpy.types.Object, uv_data: np.ndarray, loops: np.ndarray) -> List[np.ndarray]:
+    islands = get_uv_islands(*get_loop_topology(ob), uv_data, loops)
+    order = np.argsort(islands, kind='stable')
+    starts = np.unique(islands[order], return_index=True)[1]
+    return np.split(loops[order], starts[1:])
+
+
+def _get_island_bounds(uv_data: np.ndarray, islands: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    starts = np.cumsum([0] + [len(loops) for loops in islands[:-1]])
+    uv = uv_data[np.concatenate(islands)]
+    return np.minimum.reduceat(uv, starts, axis=0), np.maximum.reduceat(uv, starts, axis=0)
+
+
 def _size_sorting(item: Sequence[StructureItem]) -> Tuple[int, int, int, Union[str, Diffuse, None]]:
     gfx = item[1]['gfx']
     size_x, size_y = gfx['size']
@@ -188,8 +393,8 @@ def _size_sorting(item: Sequence[StructureItem]) -> Tuple[int, int, int, Union[s
     name_or_color = None
     if isinstance(img_or_color, tuple):
         name_or_color = gfx['img_or_color']
-    elif isinstance(img_or_color, bpy.types.PackedFile):
-        name_or_color = img_or_color.id_data.name
+    elif isinstance(img_or_color, bpy.types.Image):
+        name_or_color = img_or_color.name
 
     # Sorts by max size, then multiplied size, then size_x, then the name and color
     return max(size_x, size_y), size_x * size_y, size_x, name_or_color
@@ -205,25 +410,25 @@ def _get_image(mat: bpy.types.Material) -> Union[bpy.types.Image, None]:
 
 
 def _get_image_size(mat: bpy.types.Material, img: bpy.types.Image) -> Tuple[int, int]:
+    img_size = get_image_size(img)
     return (
         (
-            min(mat.smc_size_width, img.size[0]),
-            min(mat.smc_size_height, img.size[1]),
+            min(mat.smc_size_width, img_size[0]),
+            min(mat.smc_size_height, img_size[1]),
         )
         if mat.smc_size
-        else cast(Tuple[int, int], img.size)
+        else cast(Tuple[int, int], img_size)
     )
 
 
-def _get_max_uv_coordinates(uv_loops: List[bpy.types.MeshUVLoop]) -> Tuple[float, float]:
+def _get_max_uv_coordinates(uv_loops: List[UVLoops]) -> Tuple[float, float]:
     max_x = 1
     max_y = 1
 
-    for uv in uv_loops:
-        if not math.isnan(uv.x):
-            max_x = max(max_x, uv.x)
-        if not math.isnan(uv.y):
-            max_y = max(max_y, uv.y)
+    for uv_data, loops in uv_loops:
+        uv_max_x, uv_max_y = np.fmax.reduce(uv_data[loops], axis=0, initial=1)
+        max_x = max(max_x, float(uv_max_x))
+        max_y = max(max_y, float(uv_max_y))
 
     return max_x, max_y
 
@@ -232,17 +437,111 @@ def _calculate_size(img_size: Tuple[int, int], uv_size: Tuple[int, int], gaps: i
     return cast(Tuple[int, int], tuple(s * uv_s + gaps for s, uv_s in zip(img_size, uv_size)))
 
 
+def fit_images(scn: Scene, default_packer: Callable[..., object], images: Dict) -> Dict:
+    signature = _get_layout_signature(scn, default_packer, images)
+    cache = OrderedDict(json.loads(scn.smc_layout_cache or '{}'))
+    fits = cache.pop(signature, None)
+
+    if fits is None:
+        fitted = get_packer(scn, default_packer)(images).fit()
+        fits = [fitted[mat]['gfx']['fit'] for mat in images]
+
+    for item, fit in zip(images.values(), fits):
+        item['gfx']['fit'] = fit
+
+    cache[signature] = fits
+    while len(cache) > layout_cache_size:
+        cache.popitem(last=False)
+    scn.smc_layout_cache = json.dumps(cache, default=int)
+    return images
+
+
+def _get_layout_signature(scn: Scene, default_packer: Callable[..., object], images: Dict) -> str:
+    settings = [default_packer.__name__, scn.smc_packer, scn.smc_rotate, scn.smc_size, scn.smc_gaps, scn.smc_crop,
+                scn.smc_islands]
+    sizes = [item['gfx']['size'] for item in images.values()]
+    return hashlib.sha1(json.dumps([settings, sizes], default=float).encode()).hexdigest()
+
+
+def get_packer(scn: Scene, default_packer: Callable[..., object]) -> Callable[[Dict], object]:
+    rotate = scn.smc_rotate
+    if scn.smc_packer == 'SEARCH':
+        return partial(SearchPacker, packers=_get_search_packers(rotate), slow_packers=_get_slow_search_packers(rotate),
+                       get_score=partial(_get_layout_score, scn), get_lower_bound=partial(_get_layout_lower_bound, scn))
+    if scn.smc_packer == 'PO2_SEARCH':
+        return partial(PowerOfTwoPacker, rotate=rotate, square=scn.smc_size == 'QUAD')
+    if scn.smc_packer.startswith('MAXRECTS_'):
+        return partial(MaxRectsPacker, heuristic=scn.smc_packer[len('MAXRECTS_'):], rotate=rotate)
+    return partial(default_packer, rotate=rotate)
+
+
+def _get_search_packers(rotate: bool) -> List[Callable[[Dict], object]]:
+    return [
+        partial(BinPacker, rotate=rotate),
+        partial(SableBinPacker, rotate=rotate, verbose=False),
+    ]
+
+
+def _get_slow_search_packers(rotate: bool) -> List[Callable[[Dict], object]]:
+    return [partial(MaxRectsPacker, heuristic=heuristic, rotate=rotate) for heuristic in MaxRectsPacker.heuristics]
+
+
+def _get_layout_score(scn: Scene, layout: Dict) -> Tuple[int, float]:
+    size = get_atlas_size(layout)
+    atlas_width, atlas_height = calculate_adjusted_size(scn, size)
+    used_area = sum(item['gfx']['size'][0] * item['gfx']['size'][1] for item in layout.values())
+    return atlas_width * atlas_height, -used_area / (size[0] * size[1])
+
+
+def _get_layout_lower_bound(scn: Scene, layout: Dict) -> Tuple[int, float]:
+    # No layout is smaller than the tiles themselves, rounded up to what the atlas size setting allows
+    used_area = sum(item['gfx']['size'][0] * item['gfx']['size'][1] for item in layout.values())
+    if scn.smc_size == 'PO2':
+        used_area = 1 << int(used_area - 1).bit_length()
+    elif scn.smc_size == 'QUAD':
+        used_area = math.ceil(math.sqrt(used_area)) ** 2
+    return used_area, 0.0
+
+
+def get_page_packer(scn: Scene) -> Callable[[Dict], object]:
+    heuristic = scn.smc_packer[len('MAXRECTS_'):] if scn.smc_packer.startswith('MAXRECTS_') else 'BSSF'
+    return partial(PagePacker, page_size=scn.smc_page_size, heuristic=heuristic, rotate=scn.smc_rotate)
+
+
+def get_oversized_image_size(scn: Scene, data: Structure) -> Union[Tuple[int, int], None]:
+    return next((item['gfx']['size'] for item in data.values() if max(item['gfx']['size']) > scn.smc_page_size), None)
+
+
+def get_pages(data: Structure) -> List[Structure]:
+    pages = defaultdict(OrderedDict)
+    for mat, item in data.items():
+        pages[item['gfx']['fit']['page']][mat] = item
+    return [pages[page] for page in sorted(pages)]
+
+
+def get_page_atlas_size(scn: Scene, size: Tuple[int, int]) -> Tuple[int, int]:
+    if scn.smc_pages == 'UDIM':
+        return (scn.smc_page_size,) * 2
+    return cast(Tuple[int, int], tuple(min(x, scn.smc_page_size) for x in calculate_adjusted_size(scn, size)))
+
+
 def get_atlas_size(structure: Structure) -> Tuple[int, int]:
     max_x = 1
     max_y = 1
 
     for item in structure.values():
-        max_x = max(max_x, item['gfx']['fit']['x'] + item['gfx']['size'][0])
-        max_y = max(max_y, item['gfx']['fit']['y'] + item['gfx']['size'][1])
+        fit_width, fit_height = _get_fit_size(item)
+        max_x = max(max_x, item['gfx']['fit']['x'] + fit_width)
+        max_y = max(max_y, item['gfx']['fit']['y'] + fit_height)
 
     return int(max_x), int(max_y)
 
 
+def _get_fit_size(item: StructureItem) -> Tuple[int, int]:
+    width, height = item['gfx']['size']
+    return (height, width) if item['gfx']['fit'].get('rotated') else (width, height)
+
+
 def calculate_adjusted_size(scn: Scene, size: Tuple[int, int]) -> Tuple[int, int]:
     if scn.smc_size == 'PO2':
         return cast(Tuple[int, int], tuple(1 << int(x - 1).bit_length() for x in size))
@@ -252,114 +551,257 @@ def calculate_adjusted_size(scn: Scene, size: Tuple[int, int]) -> Tuple[int, int
 
 
 def get_atlas(scn: Scene, data: Structure, atlas_size: Tuple[int, int]) -> ImageType:
-    smc_size = (scn.smc_size_width, scn.smc_size_height)
-    img = Image.new('RGBA', atlas_size)
-    half_gaps = int(scn.smc_gaps / 2)
+    scale = _get_atlas_scale(scn, atlas_size)
+    canvas = _get_canvas(_get_canvas_size(scn, atlas_size, scale))
+    items = [(item.get('mat', key), item) for key, item in data.items()]
 
-    for mat, item in data.items():
+    for mat, item in items:
         _set_image_or_color(item, mat)
-        _paste_gfx(scn, item, mat, img, half_gaps)
+    _paste_gfxs(scn, items, canvas, scale)
+
+    return Image.fromarray(canvas, 'RGBA')
+
+
+def _get_atlas_scale(scn: Scene, atlas_size: Tuple[int, int]) -> float:
+    # Custom sizes shrink the atlas like a thumbnail would, every tile is resampled at that scale up front
+    if scn.smc_size not in ['CUST', 'STRICTCUST']:
+        return 1
+    atlas_width, atlas_height = atlas_size
+    return min(1, scn.smc_size_width / atlas_width, scn.smc_size_height / atlas_height)
 
-    if scn.smc_size in ['CUST', 'STRICTCUST']:
-        img.thumbnail(smc_size, resampling)
 
+def _get_canvas_size(scn: Scene, atlas_size: Tuple[int, int], scale: float) -> Tuple[int, int]:
     if scn.smc_size == 'STRICTCUST':
-        canvas_img = Image.new('RGBA', smc_size)
-        canvas_img.paste(img)
-        return canvas_img
+        return scn.smc_size_width, scn.smc_size_height
+    return cast(Tuple[int, int], tuple(max(1, round(x * scale)) for x in atlas_size))
+
 
-    return img
+def _get_canvas(atlas_size: Tuple[int, int]) -> np.ndarray:
+    atlas_width, atlas_height = atlas_size
+    return np.zeros((atlas_height, atlas_width, 4), dtype=np.uint8)
 
 
 def _set_image_or_color(item: StructureItem, mat: bpy.types.Material) -> None:
     if globs.is_blender_2_80_or_newer:
         shader = get_shader_type(mat) if mat else None
         node_name = shader_image_nodes.get(shader)
-        item['gfx']['img_or_color'] = get_packed_file(mat.node_tree.nodes.get(node_name).image) if node_name else None
+        item['gfx']['img_or_color'] = get_source_image(mat.node_tree.nodes.get(node_name).image) if node_name else None
     else:
-        item['gfx']['img_or_color'] = get_packed_file(get_image(get_texture(mat)))
+        item['gfx']['img_or_color'] = get_source_image(get_image(get_texture(mat)))
 
     if not item['gfx']['img_or_color']:
         item['gfx']['img_or_color'] = get_diffuse(mat)
 
 
-def _paste_gfx(scn: Scene, item: StructureItem, mat: bpy.types.Material, img: ImageType, half_gaps: int) -> None:
-    if not item['gfx']['fit']:
-        return
+def _paste_gfxs(scn: Scene, items: Iterable[Tuple[bpy.types.Material, StructureItem]], canvas: np.ndarray,
+                scale: float = 1) -> None:
+    half_gaps = int(scn.smc_gaps / 2)
+    limit = scn.smc_prefetch_limit
+    in_flight = deque()
+    decoded_images.set_budget(scn.smc_image_cache_size * 1024 * 1024)
+
+    # Decoding runs in the pool while bpy data is only touched and the canvas only written on this thread
+    with ThreadPoolExecutor(max_workers=min(limit, os.cpu_count() or 1)) as executor:
+        for mat, item in items:
+            if not item['gfx']['fit']:
+                continue
 
-    img.paste(
-        _get_gfx(scn, mat, item, item['gfx']['img_or_color']),
-        (int(item['gfx']['fit']['x'] + half_gaps), int(item['gfx']['fit']['y'] + half_gaps))
-    )
+            x, y, size, img_or_color = _get_paste_args(scn, item, half_gaps, scale)
+            if isinstance(img_or_color, tuple):
+                _fill_canvas(canvas, x, y, size, img_or_color)
+                continue
 
+            in_flight.append((x, y, executor.submit(_get_gfx, *_get_gfx_args(mat, item, img_or_color, size))))
+            if len(in_flight) >= limit:
+                _write_next_gfx(canvas, in_flight)
 
-def _get_gfx(scn: Scene, mat: bpy.types.Material, item: StructureItem,
-             img_or_color: Union[bpy.types.PackedFile, Tuple, None]) -> ImageType:
-    size = cast(Tuple[int, int], tuple(int(size - scn.smc_gaps) for size in item['gfx']['size']))
+        while in_flight:
+            _write_next_gfx(canvas, in_flight)
 
-    if not img_or_color:
-        return Image.new('RGBA', size, (1, 1, 1, 1))
 
-    if isinstance(img_or_color, tuple):
-        return Image.new('RGBA', size, img_or_color)
+def _get_paste_args(scn: Scene, item: StructureItem, half_gaps: int,
+                    scale: float) -> Tuple[int, int, Tuple[int, int], Union[bpy.types.Image, Diffuse]]:
+    x = int(item['gfx']['fit']['x'] + half_gaps)
+    y = int(item['gfx']['fit']['y'] + half_gaps)
+    img_or_color = item['gfx']['img_or_color'] or (1, 1, 1, 1)
 
-    img = Image.open(io.BytesIO(img_or_color.data))
-    if img.size != size:
-        img.resize(size, resampling)
-    if mat.smc_size:
-        img.thumbnail((mat.smc_size_width, mat.smc_size_height), resampling)
-    if max(item['gfx']['uv_size'], default=0) > 1:
-        img = _get_uv_image(item, img, size)
-    if mat.smc_diffuse:
-        diffuse_img = Image.new(img.mode, size, get_diffuse(mat))
-        img = ImageChops.multiply(img, diffuse_img)
+    width, height = _get_gfx_size(scn, item)
+    if item['gfx']['fit'].get('rotated'):
+        width, height = height, width
 
-    return img
+    # Both edges are scaled, so neighbouring tiles neither overlap nor leave a gap after rounding
+    scaled_x, scaled_y = round(x * scale), round(y * scale)
+    size = (max(1, round((x + width) * scale) - scaled_x), max(1, round((y + height) * scale) - scaled_y))
+    return scaled_x, scaled_y, size, img_or_color
 
 
-def _get_uv_image(item: StructureItem, img: ImageType, size: Tuple[int, int]) -> ImageType:
-    uv_img = Image.new('RGBA', size)
-    size_height = size[1]
-    img_width, img_height = img.size
-    uv_width, uv_height = (math.ceil(x) for x in item['gfx']['uv_size'])
+def _write_next_gfx(canvas: np.ndarray, in_flight: deque) -> None:
+    x, y, future = in_flight.popleft()
+    _write_canvas(canvas, x, y, future.result())
 
-    for h in range(uv_height):
-        y = size_height - img_height - h * img_height
-        for w in range(uv_width):
-            x = w * img_width
-            uv_img.paste(img, (x, y))
 
-    return uv_img
+def _get_gfx_size(scn: Scene, item: StructureItem) -> Tuple[int, int]:
+    return cast(Tuple[int, int], tuple(int(size - scn.smc_gaps) for size in item['gfx']['size']))
 
 
-def align_uvs(scn: Scene, data: Structure, atlas_size: Tuple[int, int], size: Tuple[int, int]) -> None:
-    size_width, size_height = size
+def _fill_canvas(canvas: np.ndarray, x: int, y: int, size: Tuple[int, int], color: Diffuse) -> None:
+    width, height = size
+    canvas[y:y + height, x:x + width] = _get_rgba(color)
+
+
+def _write_canvas(canvas: np.ndarray, x: int, y: int, gfx: np.ndarray) -> None:
+    height, width = gfx.shape[:2]
+    canvas[y:y + height, x:x + width] = gfx[:canvas.shape[0] - y, :canvas.shape[1] - x]
+
+
+def _get_rgba(color: Diffuse) -> Tuple[int, int, int, int]:
+    return cast(Tuple[int, int, int, int], tuple(int(c) for c in color) + (255,) * (4 - len(color)))
+
+
+def _get_gfx_args(mat: bpy.types.Material, item: StructureItem, img_or_color: bpy.types.Image,
+                  size: Tuple[int, int]) -> Tuple:
+    rotated = bool(item['gfx']['fit'].get('rotated'))
+    return (
+        img_or_color.as_pointer(),
+        read_image_source(img_or_color),
+        get_image_size(img_or_color),
+        _get_image_size(mat, img_or_color),
+        size[::-1] if rotated else size,
+        tuple(item['gfx']['uv_size']),
+        item['gfx'].get('crop'),
+        get_diffuse(mat) if mat.smc_diffuse else None,
+        item['gfx'].get('uv_offset'),
+        rotated,
+    )
+
+
+def _get_gfx(pointer: int, source: ImageSource, source_size: Tuple[int, int], img_size: Tuple[int, int],
+             size: Tuple[int, int], uv_size: Tuple[float, float], crop: Union[Tuple[int, int, int, int], None],
+             diffuse: Union[Diffuse, None], uv_offset: Union[Tuple[float, float], None], rotated: bool) -> np.ndarray:
+    # Repeating tiles are resampled to one repeat, so the repeats and the UV offset stay on the texture pixel grid
+    repeats = bool(uv_offset) or max(uv_size, default=0) > 1
+    target_size = img_size if repeats else size
+
+    img = _get_source_gfx(pointer, source, source_size, img_size, target_size, crop)
+    img = _resample_image(img, img_size, target_size, crop)
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+
+    gfx = np.asarray(img)
+    if diffuse:
+        gfx = _multiply_diffuse(gfx, diffuse)
+    if uv_offset:
+        gfx = _get_offset_gfx(gfx, uv_offset)
+    if repeats:
+        uv_gfx_size = cast(Tuple[int, int], tuple(int(s * uv_s) for s, uv_s in zip(img_size, uv_size)))
+        gfx = _get_uv_gfx(gfx, uv_gfx_size)
+        if uv_gfx_size != size:
+            gfx = np.asarray(_resample_image(Image.fromarray(gfx, 'RGBA'), uv_gfx_size, size, None))
+
+    return np.rot90(gfx, -1) if rotated else gfx
+
+
+def _get_source_gfx(pointer: int, source: ImageSource, source_size: Tuple[int, int], img_size: Tuple[int, int],
+                    size: Tuple[int, int], crop: Union[Tuple[int, int, int, int], None]) -> ImageType:
+    # JPEGs that are at least halved are decoded at a reduced scale, which still covers the requested size.
+    # Other formats always decode at full size, so they share one cache entry
+    if not is_jpeg(source):
+        return get_decoded_image(pointer, source)
+    region_size = (crop[2] - crop[0], crop[3] - crop[1]) if crop else img_size
+    draft_size = tuple(math.ceil(s * t / r) for s, t, r in zip(img_size, size, region_size))
+    if any(d * 2 > s for d, s in zip(draft_size, source_size)):
+        draft_size = None
+    return get_decoded_image(pointer, source, draft_size)
+
+
+def _resample_image(img: ImageType, img_size: Tuple[int, int], size: Tuple[int, int],
+                    crop: Union[Tuple[int, int, int, int], None]) -> ImageType:
+    # The crop is given at the texture size, the box maps it to the decoded pixels and is resampled in the same pass
+    scale_x, scale_y = (s / t for s, t in zip(img.size, img_size))
+    x0, y0, x1, y1 = crop or (0, 0) + tuple(img_size)
+    box = (x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y)
+    if box == (0, 0) + img.size and img.size == size:
+        return img
+    if box == tuple(map(round, box)) and (box[2] - box[0], box[3] - box[1]) == size:
+        return img.crop(tuple(map(round, box)))
+
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    if img.mode == 'RGB':
+        return img.resize(size, resampling, box=box, **resize_options)
+    # Premultiplied, so transparent texels don't bleed their color. PIL would do it for RGBA too but drop reducing_gap
+    return img.convert('RGBa').resize(size, resampling, box=box, **resize_options).convert('RGBA')
+
+
+def _multiply_diffuse(gfx: np.ndarray, diffuse: Diffuse) -> np.ndarray:
+    # Same rounding as ImageChops.multiply, applied in place of a full-size diffuse image
+    return (gfx.astype(np.uint16) * np.array(_get_rgba(diffuse), dtype=np.uint16) // 255).astype(np.uint8)
+
+
+def _get_offset_gfx(gfx: np.ndarray, uv_offset: Tuple[float, float]) -> np.ndarray:
+    # The bottom left corner of the tile starts at the UV offset instead of the texture origin
+    height, width = gfx.shape[:2]
+    return np.roll(gfx, (round(uv_offset[1] * height), -round(uv_offset[0] * width)), axis=(0, 1))
+
+
+def _get_uv_gfx(gfx: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    # Repeats are anchored to the bottom left corner, the fractional UV size is cut as a view
+    width, height = size
+    img_height, img_width = gfx.shape[:2]
+    uv_height, uv_width = -(-height // img_height), -(-width // img_width)
+    return np.tile(gfx, (uv_height, uv_width, 1))[uv_height * img_height - height:, :width]
 
-    scaled_width, scaled_height = _get_scale_factors(atlas_size, size)
+
+def align_uvs(scn: Scene, data: Structure, atlas_size: Tuple[int, int], size: Tuple[int, int]) -> None:
+    scale_factors = _get_scale_factors(atlas_size, size)
 
     margin = scn.smc_gaps + (0 if scn.smc_pixel_art else 2)
     border_margin = int(scn.smc_gaps / 2) + (0 if scn.smc_pixel_art else 1)
 
     for item in data.values():
-        gfx_size = item['gfx']['size']
-        gfx_height = gfx_size[1]
+        _align_item_uvs(item, size, scale_factors, margin, border_margin)
+
+
+def _align_item_uvs(item: StructureItem, size: Tuple[int, int], scale_factors: Tuple[float, float], margin: int,
+                    border_margin: int) -> None:
+    size_width, size_height = size
+    scaled_width, scaled_height = scale_factors
 
-        gfx_width_margin, gfx_height_margin = (x - margin for x in gfx_size)
+    gfx_width, gfx_height = _get_fit_size(item)
+    uv_width, uv_height = item['gfx']['uv_size']
 
-        uv_width, uv_height = item['gfx']['uv_size']
+    x_offset = item['gfx']['fit']['x'] + border_margin
+    y_offset = item['gfx']['fit']['y'] - border_margin
 
-        x_offset = item['gfx']['fit']['x'] + border_margin
-        y_offset = item['gfx']['fit']['y'] - border_margin
+    # uv / uv_size * gfx_margin + offset, divided by the atlas size and scaled, folded into one affine transform
+    scale_x = (gfx_width - margin) / size_width * scaled_width
+    scale_y = (gfx_height - margin) / size_height * scaled_height
+    offset_x = x_offset / size_width * scaled_width
+    offset_y = 1 - (gfx_height + y_offset) / size_height * scaled_height
 
-        for uv in item['uv']:
-            reset_x = uv.x / uv_width * gfx_width_margin
-            reset_y = uv.y / uv_height * gfx_height_margin - gfx_height
+    if item['gfx']['fit'].get('rotated'):
+        # The image was turned clockwise, so the tile coordinates (u, v) land on (v, 1 - u)
+        matrix = np.array(((0, -scale_y / uv_width), (scale_x / uv_height, 0)))
+        offset = np.array((offset_x, offset_y + scale_y))
+    else:
+        matrix = np.array(((scale_x / uv_width, 0), (0, scale_y / uv_height)))
+        offset = np.array((offset_x, offset_y))
+
+    if 'crop_uv' in item['gfx']:
+        # Island tiles first move the cropped region of the texture to the 0-1 range
+        crop_x, crop_y, crop_width, crop_height = item['gfx']['crop_uv']
+        offset = offset - np.array((crop_x / crop_width, crop_y / crop_height)) @ matrix
+        matrix = matrix / np.array(((crop_width,), (crop_height,)))
 
-            uv_x = (reset_x + x_offset) / size_width
-            uv_y = (reset_y - y_offset) / size_height
+    for uv_data, loops in item['uv']:
+        uv_data[loops] = uv_data[loops] @ matrix + offset
 
-            uv.x = uv_x * scaled_width
-            uv.y = uv_y * scaled_height + 1
+
+def _offset_udim_uvs(data: Structure, page: int) -> None:
+    offset = np.array((page % 10, page // 10))
+    for item in data.values():
+        for uv_data, loops in item['uv']:
+            uv_data[loops] += offset
 
 
 def _get_scale_factors(atlas_size: Tuple[int, int], size: Tuple[int, int]) -> Tuple[float, float]:
@@ -383,6 +825,51 @@ def get_comb_mats(scn: Scene, atlas: ImageType, mats_uv: MatsUV) -> CombMats:
     return cast(CombMats, {idx: _create_material(texture, unique_id, idx) for idx in layers})
 
 
+def get_comb_mats_pages(scn: Scene, data: Structure, page_data: SMCObData) -> CombMats:
+    unique_id = _get_unique_id(scn)
+    paths = [_save_atlas_page(scn, page_structure, unique_id, page)
+             for page, page_structure in enumerate(get_pages(data))]
+    keys = set(chain.from_iterable(item.values() for item in page_data.values()))
+
+    if scn.smc_pages == 'UDIM':
+        texture = _create_udim_texture(paths, '{0}{1}'.format(atlas_texture_prefix, unique_id))
+        return cast(CombMats, {idx: _create_material(texture, unique_id, idx) for idx in keys})
+
+    textures = [_create_texture(path, '{0}_{1}'.format(unique_id, page)) for page, path in enumerate(paths)]
+    return cast(CombMats, {
+        (idx, page): _create_material(textures[page], unique_id, '{0}_{1}'.format(idx, page))
+        for idx, page in keys
+    })
+
+
+def get_page_data(scn: Scene, data: SMCObData, mats_uv: MatsUV, structure: Structure) -> SMCObData:
+    page_data = {}
+    for ob_n, item in data.items():
+        page_data[ob_n] = {}
+        for mat, layer in item.items():
+            root_mat = mat.root_mat or mat
+            if mat not in mats_uv[ob_n] or root_mat not in structure:
+                continue
+            if scn.smc_pages == 'UDIM':
+                page_data[ob_n][mat] = layer
+            else:
+                page_data[ob_n][mat] = (layer, structure[root_mat]['gfx']['fit']['page'])
+    return page_data
+
+
+def _save_atlas_page(scn: Scene, data: Structure, unique_id: str, page: int) -> str:
+    size = get_atlas_size(data)
+    atlas = get_atlas(scn, data, get_page_atlas_size(scn, size))
+    align_uvs(scn, data, atlas.size, size)
+    if scn.smc_pages == 'UDIM':
+        _offset_udim_uvs(data, page)
+    return _save_atlas(scn, atlas, unique_id, _get_page_suffix(scn, page))
+
+
+def _get_page_suffix(scn: Scene, page: int) -> str:
+    return '.{0}'.format(1001 + page) if scn.smc_pages == 'UDIM' else '_{0}'.format(page)
+
+
 def _get_layers(scn: Scene, mats_uv: MatsUV) -> Set[int]:
     return {
         item.layer
@@ -404,7 +891,7 @@ def _get_unique_id(scn: Scene) -> str:
 
 
 def _add_its_from_existing_materials(scn: Scene, existed_ids: Set[int]) -> None:
-    atlas_material_pattern = re.compile(r'{0}(\d+)_\d+'.format(atlas_material_prefix))
+    atlas_material_pattern = re.compile(r'{0}(\d+)_\d+(?:_\d+)?'.format(atlas_material_prefix))
     for item in scn.smc_ob_data:
         if item.type != globs.CL_MATERIAL:
             continue
@@ -420,15 +907,15 @@ def _generate_random_unique_id(existed_ids: Set[int]) -> str:
 
 
 def _add_ids_from_existing_files(scn: Scene, existed_ids: Set[int]) -> None:
-    atlas_file_pattern = re.compile(r'{0}(\d+).png'.format(atlas_prefix))
+    atlas_file_pattern = re.compile(r'{0}(\d+)(?:[_.]\d+)?.png'.format(atlas_prefix))
     for file_name in os.listdir(scn.smc_save_path):
         match = atlas_file_pattern.fullmatch(file_name)
         if match:
             existed_ids.add(int(match.group(1)))
 
 
-def _save_atlas(scn: Scene, atlas: ImageType, unique_id: str) -> str:
-    path = os.path.join(scn.smc_save_path, '{0}{1}.png'.format(atlas_prefix, unique_id))
+def _save_atlas(scn: Scene, atlas: ImageType, unique_id: str, suffix: str = '') -> str:
+    path = os.path.join(scn.smc_save_path, '{0}{1}{2}.png'.format(atlas_prefix, unique_id, suffix))
     atlas.save(path)
     return path
 
@@ -440,7 +927,19 @@ def _create_texture(path: str, unique_id: str) -> bpy.types.Texture:
     return texture
 
 
-def _create_material(texture: bpy.types.Texture, unique_id: str, idx: int) -> bpy.types.Material:
+def _create_udim_texture(paths: List[str], texture_name: str) -> bpy.types.Texture:
+    texture = bpy.data.textures.new(texture_name, 'IMAGE')
+    image = bpy.data.images.load(paths[0])
+    image.source = 'TILED'
+    for tile_number in range(1002, 1001 + len(paths)):
+        if image.tiles.get(tile_number) is None:
+            image.tiles.new(tile_number=tile_number)
+    image.reload()
+    texture.image = image
+    return texture
+
+
+def _create_material(texture: bpy.types.Texture, unique_id: str, idx: Union[int, str]) -> bpy.types.Material:
     mat = bpy.data.materials.new(name='{0}{1}_{2}'.format(atlas_material_prefix, unique_id, idx))
     if globs.is_blender_2_80_or_newer:
         _configure_material(mat, texture)
@@ -491,14 +990,14 @@ def _assign_mats(item: SMCObDataItem, comb_mats: CombMats, ob_materials: ObMats)
 
 
 def _assign_mats_to_polys(item: SMCObDataItem, comb_mats: CombMats, ob: bpy.types.Object, ob_materials: ObMats) -> None:
-    for idx, polys in get_polys(ob).items():
+    mapping = {}
+    for idx in get_polys(ob):
         if ob_materials[idx] not in item:
             continue
-        
+
         mat_name = comb_mats[item[ob_materials[idx]]].name
-        mat_idx = ob_materials.find(mat_name)
-        for poly in polys:
-            poly.material_index = mat_idx
+        mapping[idx] = ob_materials.find(mat_name)
+    remap_material_index(ob, mapping)
 
 
 def clear_mats(scn: Scene, mats_uv: MatsUV) -> None:
@@ -515,12 +1014,12 @@ def get_mats_uv_sable(scn: Scene, data: SMCObData) -> MatsUV:
     mats_uv = defaultdict(lambda: defaultdict(list))
     for ob_n, item in data.items():
         ob = scn.objects[ob_n]
-        for idx, polys in get_polys(ob).items():
+        uv_data = get_uv_data(ob)
+        for idx, (loop_start, loop_total) in get_poly_loops(ob).items():
             mat = ob.data.materials[idx]
             if mat not in item:
                 continue
-            for poly in polys:
-                mats_uv[ob_n][mat].extend(get_uv(ob, poly))
+            mats_uv[ob_n][mat].append((uv_data, get_loop_indices(loop_start, loop_total)))
     return mats_uv
 
 def get_data_sable(data: Sequence[bpy.types.PropertyGroup]) -> SMCObData:
@@ -642,8 +1141,8 @@ def _size_sorting_sable(item: Sequence[StructureItem]) -> Tuple[int, int, int, U
     name_or_color = None
     if isinstance(img_or_color, tuple):
         name_or_color = gfx['img_or_color']
-    elif isinstance(img_or_color, bpy.types.PackedFile):
-        name_or_color = img_or_color.id_data.name
+    elif isinstance(img_or_color, bpy.types.Image):
+        name_or_color = img_or_color.name
 
     # Sorts by size_y, then multiplied size, then size_x, then the name and color
     return size_y, size_x * size_y, size_x, name_or_color
@@ -652,14 +1151,14 @@ def _size_sorting_sable(item: Sequence[StructureItem]) -> Tuple[int, int, int, U
 def get_size_sable(scn: Scene, data: Structure) -> Dict:
     for mat, item in data.items():
         img = _get_image_sable(mat)
-        packed_file = get_packed_file(img)
+        source_image = get_source_image(img)
         max_x, max_y = _get_max_uv_coordinates(item['uv'])
         item['gfx']['uv_size'] = (np.clip(max_x, 1, 25), np.clip(max_y, 1, 25))
 
         if not scn.smc_crop:
             item['gfx']['uv_size'] = tuple(math.ceil(x) for x in item['gfx']['uv_size'])
 
-        if packed_file:
+        if source_image:
             img_size = _get_image_size(mat, img)
             item['gfx']['size'] = _calculate_size(img_size, item['gfx']['uv_size'], scn.smc_gaps)
         else:
@@ -683,23 +1182,14 @@ def _get_image_sable(mat: bpy.types.Material) -> Union[bpy.types.Image, None]:
 
 
 def get_atlas_sable(scn: Scene, data: Structure, atlas_size: Tuple[int, int]) -> ImageType:
-    smc_size = (scn.smc_size_width, scn.smc_size_height)
-    img = Image.new('RGBA', atlas_size)
-    half_gaps = int(scn.smc_gaps / 2)
+    scale = _get_atlas_scale(scn, atlas_size)
+    canvas = _get_canvas(_get_canvas_size(scn, atlas_size, scale))
 
     for mat, item in data.items():
         _set_image_or_color_sable(item, mat)
-        _paste_gfx(scn, item, mat, img, half_gaps)
-
-    if scn.smc_size in ['CUST', 'STRICTCUST']:
-        img.thumbnail(smc_size, resampling)
+    _paste_gfxs(scn, data.items(), canvas, scale)
 
-    if scn.smc_size == 'STRICTCUST':
-        canvas_img = Image.new('RGBA', smc_size)
-        canvas_img.paste(img)
-        return canvas_img
-
-    return img
+    return Image.fromarray(canvas, 'RGBA')
 
 
 def _set_image_or_color_sable(item: StructureItem, mat: bpy.types.Material) -> None:
@@ -707,13 +1197,13 @@ def _set_image_or_color_sable(item: StructureItem, mat: bpy.types.Material) -> N
         #print("FOWOFIJS: " + mat.node_tree.nodes.active.type)
         if mat.node_tree.nodes.active.type == 'TEX_IMAGE':
             #print("SetImageOrColor: " + mat.name + " active node: " + mat.node_tree.nodes.active.type)
-            item['gfx']['img_or_color'] = get_packed_file(mat.node_tree.nodes.active.image)
+            item['gfx']['img_or_color'] = get_source_image(mat.node_tree.nodes.active.image)
         else:
             shader = get_shader_type(mat) if mat else None
             node_name = shader_image_nodes.get(shader)
-            item['gfx']['img_or_color'] = get_packed_file(mat.node_tree.nodes.get(node_name).image) if node_name else None
+            item['gfx']['img_or_color'] = get_source_image(mat.node_tree.nodes.get(node_name).image) if node_name else None
     else:
-        item['gfx']['img_or_color'] = get_packed_file(get_image(get_texture(mat)))
+        item['gfx']['img_or_color'] = get_source_image(get_image(get_texture(mat)))
 
     if not item['gfx']['img_or_color']:
         item['gfx']['img_or_color'] = get_diffuse(mat)
@@ -730,6 +1220,130 @@ def create_atlas_material_sable(scn: Scene, atlas: ImageType, mats_uv: MatsUV, a
     return _create_material_sable(texture, atlasName)
 
 
+def create_atlas_page_materials_sable(scn: Scene, data: Structure, atlasName: str, createTexture: bool) -> List[bpy.types.Material]:
+    paths = []
+    for page, page_structure in enumerate(get_pages(data)):
+        size = get_atlas_size(page_structure)
+        atlas = get_atlas_sable(scn, page_structure, get_page_atlas_size(scn, size))
+        align_uvs_sable(scn, page_structure, atlasName, atlas.size, size)
+        if scn.smc_pages == 'UDIM':
+            _offset_udim_uvs(page_structure, page)
+
+        path = '{0}/AtlasedTextures/{1}{2}.png'.format(os.path.dirname(bpy.data.filepath), atlasName, _get_page_suffix(scn, page))
+        if createTexture:
+            atlas.save(path)
+        paths.append(path)
+
+    if scn.smc_pages == 'UDIM':
+        texture = None
+        if createTexture:
+            texture = _create_udim_texture(paths, '{0}/AtlasedTextures/{1}'.format(os.path.dirname(bpy.data.filepath), atlasName))
+        return [_create_material_sable(texture, atlasName)] * len(paths)
+
+    materials = []
+    for page, path in enumerate(paths):
+        page_name = '{0}_{1}'.format(atlasName, page)
+        texture = _create_texture_sable(path, page_name) if createTexture else None
+        materials.append(_create_material_sable(texture, page_name))
+    return materials
+
+
+def get_incremental_atlas_sable(scn: Scene, data: Structure, atlasName: str) -> Union[ImageType, None]:
+    layout = _load_layout_sable(atlasName)
+    path = '{0}/AtlasedTextures/{1}.png'.format(os.path.dirname(bpy.data.filepath), atlasName)
+    if not layout or layout['settings'] != _get_layout_settings_sable(scn) or not os.path.isfile(path):
+        return None
+
+    atlas_width, atlas_height = layout['atlas_size']
+    canvas = np.array(Image.open(path).convert('RGBA'))
+    if canvas.shape[:2] != (atlas_height, atlas_width):
+        return None
+
+    free_space = MaxRectsPacker({}, rotate=scn.smc_rotate)
+    free_space.reset(atlas_width, atlas_height)
+    kept = set()
+    touched = []
+    content_hashes = _get_content_hashes_sable(data)
+
+    for mat, item in data.items():
+        tile = layout['tiles'].get(mat.name)
+        if tile and tile['signature'] == _get_tile_signature_sable(mat, item, content_hashes):
+            item['gfx']['fit'] = tile['fit']
+            free_space.place_rect((tile['fit']['x'], tile['fit']['y']) + _get_fit_size(item))
+            kept.add(mat.name)
+        else:
+            touched.append(mat)
+
+    for mat in touched:
+        fit = free_space.insert(*data[mat]['gfx']['size'])
+        if not fit:
+            return None
+        data[mat]['gfx']['fit'] = fit
+
+    for name, tile in layout['tiles'].items():
+        if name not in kept:
+            x, y = (int(tile['fit'][key]) for key in ('x', 'y'))
+            width, height = (int(size) for size in tile['fit_size'])
+            canvas[y:y + height, x:x + width] = 0
+
+    for mat in touched:
+        _set_image_or_color_sable(data[mat], mat)
+    _paste_gfxs(scn, ((mat, data[mat]) for mat in touched), canvas)
+
+    return Image.fromarray(canvas)
+
+
+def save_layout_sable(scn: Scene, data: Structure, atlasName: str, atlas_size: Tuple[int, int]) -> None:
+    content_hashes = _get_content_hashes_sable(data)
+    layout = {
+        'settings': _get_layout_settings_sable(scn),
+        'atlas_size': atlas_size,
+        'tiles': {
+            mat.name: {
+                'signature': _get_tile_signature_sable(mat, item, content_hashes),
+                'fit': item['gfx']['fit'],
+                'fit_size': _get_fit_size(item),
+            }
+            for mat, item in data.items()
+            if item['gfx']['fit']
+        }
+    }
+    with open(_get_layout_path_sable(atlasName), 'w') as layout_file:
+        json.dump(layout, layout_file, default=float)
+
+
+def can_update_incrementally_sable(scn: Scene, createTexture: bool) -> bool:
+    return createTexture and scn.smc_size not in ['CUST', 'STRICTCUST']
+
+
+def _load_layout_sable(atlasName: str) -> Union[Dict, None]:
+    try:
+        with open(_get_layout_path_sable(atlasName)) as layout_file:
+            return json.load(layout_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _get_layout_path_sable(atlasName: str) -> str:
+    return '{0}/AtlasedTextures/{1}.json'.format(os.path.dirname(bpy.data.filepath), atlasName)
+
+
+def _get_layout_settings_sable(scn: Scene) -> List:
+    return [scn.smc_size, scn.smc_gaps, scn.smc_crop, scn.smc_diffuse_size]
+
+
+def _get_content_hashes_sable(data: Structure) -> Dict[bpy.types.Image, str]:
+    # Pixel hashes also catch unsaved paint and generated images, where the file and its mtime stay the same
+    return get_content_hashes(filter(None, (get_source_image(_get_image_sable(mat)) for mat in data)))
+
+
+def _get_tile_signature_sable(mat: bpy.types.Material, item: StructureItem,
+                              content_hashes: Dict[bpy.types.Image, str]) -> str:
+    content_hash = content_hashes.get(get_source_image(_get_image_sable(mat)))
+    return json.dumps([content_hash, mat.smc_diffuse, get_diffuse(mat), item['gfx']['size'], item['gfx']['uv_size']],
+                      default=float)
+
+
 def _create_texture_sable(path: str, atlasName: str) -> bpy.types.Texture:
     texture = bpy.data.textures.new('{0}/AtlasedTextures/{1}'.format(os.path.dirname(bpy.data.filepath), atlasName), 'IMAGE')
     image = bpy.data.images.load(path)
@@ -772,37 +1386,37 @@ def assign_atlased_material_sable(scn: Scene, data: dict, atlased_material: bpy.
         _assign_material_to_polys_sable(materials, atlased_material.name, ob, ob_materials)
 
 
-def _assign_material_to_polys_sable(materials: list, atlased_material_name: str, ob: bpy.types.Object, ob_materials: ObMats) -> None:
-    for idx, polys in get_polys(ob).items():
-        if ob_materials[idx] not in materials:
-            continue
-        
-        mat_idx = ob_materials.find(atlased_material_name)
-        for poly in polys:
-            poly.material_index = mat_idx
-
-def align_uvs_sable(scn: Scene, data: Structure, temp_atlas_name: str, atlas_size: Tuple[int, int], size: Tuple[int, int]) -> None:
-    size_width, size_height = size
-
-    scaled_width, scaled_height = _get_scale_factors(atlas_size, size)
+def assign_atlased_page_materials_sable(scn: Scene, data: dict, structure: Structure, page_materials: List[bpy.types.Material]) -> None:
+    for ob_n, materials in data.items():
+        ob = scn.objects[ob_n]
+        ob_materials = ob.data.materials
+        mat_pages = {
+            mat: structure[mat.root_mat or mat]['gfx']['fit']['page']
+            for mat in materials
+            if (mat.root_mat or mat) in structure
+        }
 
-    for item in data.values():
-        gfx_size = item['gfx']['size']
-        gfx_height = gfx_size[1]
+        for atlased_material in OrderedDict.fromkeys(page_materials[page] for page in sorted(set(mat_pages.values()))):
+            ob_materials.append(atlased_material)
 
-        gfx_width_margin, gfx_height_margin = (x for x in gfx_size)
+        mapping = {
+            idx: ob_materials.find(page_materials[mat_pages[ob_materials[idx]]].name)
+            for idx in get_polys(ob)
+            if ob_materials[idx] in mat_pages
+        }
+        remap_material_index(ob, mapping)
 
-        uv_width, uv_height = item['gfx']['uv_size']
 
-        for uv in item['uv']:
-            reset_x = uv.x / uv_width * gfx_width_margin
-            reset_y = uv.y / uv_height * gfx_height_margin - gfx_height
+def _assign_material_to_polys_sable(materials: list, atlased_material_name: str, ob: bpy.types.Object, ob_materials: ObMats) -> None:
+    mat_idx = ob_materials.find(atlased_material_name)
+    mapping = {idx: mat_idx for idx in get_polys(ob) if ob_materials[idx] in materials}
+    remap_material_index(ob, mapping)
 
-            uv_x = (reset_x + item['gfx']['fit']['x']) / size_width
-            uv_y = (reset_y - item['gfx']['fit']['y']) / size_height
+def align_uvs_sable(scn: Scene, data: Structure, temp_atlas_name: str, atlas_size: Tuple[int, int], size: Tuple[int, int]) -> None:
+    scale_factors = _get_scale_factors(atlas_size, size)
 
-            uv.x = uv_x * scaled_width
-            uv.y = uv_y * scaled_height + 1
+    for item in data.values():
+        _align_item_uvs(item, size, scale_factors, 0, 0)
 
 def clear_mats_sable(scn: Scene, mats_uv: MatsUV, seperateMaterials: List) -> None:
     for ob_n, item in mats_uv.items():
@@ -848,9 +1462,7 @@ def organize_materials_sable(scn: Scene) -> None:
             item.ob.material_slots[i].material = materialInfo[i][2]
 
         # Re-assign polys to new material
-        for idx, polys in get_polys(item.ob).items():            
-            for poly in polys:
-                poly.material_index = oldIndexToNewIndex[poly.material_index]        
+        remap_material_index(item.ob, dict(enumerate(oldIndexToNewIndex)))
 
         #for i in range(len(oldIndexToNewIndex)):
         #    print("Old Index: " + str(i) + " -> New Index: " + str(oldIndexToNewIndex[i]))
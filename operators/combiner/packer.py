@@ -18,50 +18,113 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from typing import Union
+import bisect
+import math
+import time
+from collections import OrderedDict
+from typing import Callable
 from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+Rect = Tuple[float, float, float, float]
+
+size_orderings = OrderedDict([
+    ('MAX_SIDE', lambda size: (max(size), size[0] * size[1], size[0])),
+    ('AREA', lambda size: (size[0] * size[1], max(size))),
+    ('HEIGHT', lambda size: (size[1], size[0])),
+    ('WIDTH', lambda size: (size[0], size[1])),
+    ('PERIMETER', lambda size: (size[0] + size[1], max(size))),
+])
 
 
 class BinPacker(object):
-    def __init__(self, images: Dict) -> None:
-        self.root = {}
+    def __init__(self, images: Dict, rotate: bool = False) -> None:
         self.bin = images
+        self.rotate = rotate
+        self.root = 0
+        self.count = 0
+        self.x = []
+        self.y = []
+        self.w = []
+        self.h = []
+        self.right = []
+        self.down = []
 
     def fit(self) -> Dict:
-        self.root = {'x': 0, 'y': 0, 'w': 0, 'h': 0}
+        # Every image splits one node into two and every growth adds two more
+        capacity = 4 * len(self.bin) + 1
+        self.x, self.y, self.w, self.h = ([0] * capacity for _ in range(4))
+        self.right, self.down = ([-1] * capacity for _ in range(2))
+        self.count = 0
 
         if not self.bin:
             return self.bin
 
-        self.root['w'], self.root['h'] = next(iter(self.bin.values()))['gfx']['size']
+        self.root = self.add_node(0, 0, *next(iter(self.bin.values()))['gfx']['size'])
 
         for img in self.bin.values():
             w, h = img['gfx']['size']
-            node = self.find_node(self.root, w, h)
-            img['gfx']['fit'] = self.split_node(node, w, h) if node else self.grow_node(w, h)
+            img['gfx']['fit'] = self.fit_image(w, h)
 
         return self.bin
 
-    def find_node(self, root: Dict, w: int, h: int) -> Union[Dict, None]:
-        if 'used' in root and root['used']:
-            return self.find_node(root['right'], w, h) or self.find_node(root['down'], w, h)
-        elif w <= root['w'] and h <= root['h']:
-            return root
-        return None
+    def fit_image(self, w: int, h: int) -> Union[Dict, None]:
+        node = self.find_node(w, h)
+        if node != -1:
+            return self.split_node(node, w, h)
+
+        node = self.find_node(h, w) if self.rotate else -1
+        if node != -1:
+            return self.rotate_fit(self.split_node(node, h, w))
+
+        fit = self.grow_node(w, h)
+        if not fit and self.rotate:
+            fit = self.rotate_fit(self.grow_node(h, w))
+        return fit
 
     @staticmethod
-    def split_node(node: Dict, w: int, h: int) -> Dict:
-        node['used'] = True
-        node['down'] = {'x': node['x'], 'y': node['y'] + h, 'w': node['w'], 'h': node['h'] - h}
-        node['right'] = {'x': node['x'] + w, 'y': node['y'], 'w': node['w'] - w, 'h': h}
+    def rotate_fit(fit: Union[Dict, None]) -> Union[Dict, None]:
+        if fit:
+            fit['rotated'] = True
+        return fit
+
+    def add_node(self, x: int, y: int, w: int, h: int, right: int = -1, down: int = -1) -> int:
+        node = self.count
+        self.x[node], self.y[node], self.w[node], self.h[node] = x, y, w, h
+        self.right[node], self.down[node] = right, down
+        self.count += 1
         return node
 
-    def grow_node(self, w: int, h: int) -> Union[Dict, None]:     
-        can_grow_right = h <= self.root['h']
-        can_grow_down = w <= self.root['w']
-
-        should_grow_right = can_grow_right and self.root['h'] >= self.root['w'] + w
-        should_grow_down = can_grow_down and self.root['w'] >= self.root['h'] + h
+    def find_node(self, w: int, h: int) -> int:
+        # Depth-first, visiting the right branch of a used node before its down branch
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if self.right[node] != -1:
+                stack.append(self.down[node])
+                stack.append(self.right[node])
+            elif w <= self.w[node] and h <= self.h[node]:
+                return node
+        return -1
+
+    def split_node(self, node: int, w: int, h: int) -> Dict:
+        x, y, node_w, node_h = self.x[node], self.y[node], self.w[node], self.h[node]
+        self.down[node] = self.add_node(x, y + h, node_w, node_h - h)
+        self.right[node] = self.add_node(x + w, y, node_w - w, h)
+        return {'x': x, 'y': y, 'w': node_w, 'h': node_h}
+
+    def grow_node(self, w: int, h: int) -> Union[Dict, None]:
+        root_w, root_h = self.w[self.root], self.h[self.root]
+
+        can_grow_right = h <= root_h
+        can_grow_down = w <= root_w
+
+        should_grow_right = can_grow_right and root_h >= root_w + w
+        should_grow_down = can_grow_down and root_w >= root_h + h
 
         if should_grow_right or not should_grow_down and can_grow_right:
             return self.grow_right(w, h)
@@ -70,254 +133,421 @@ class BinPacker(object):
         return None
 
     def grow_right(self, w: int, h: int) -> Union[Dict, None]:
-        self.root = {
-            'used': True,
-            'x': 0,
-            'y': 0,
-            'w': self.root['w'] + w,
-            'h': self.root['h'],
-            'down': self.root,
-            'right': {'x': self.root['w'], 'y': 0, 'w': w, 'h': self.root['h']}
-        }
-        node = self.find_node(self.root, w, h)
-        return self.split_node(node, w, h) if node else None
+        root_w, root_h = self.w[self.root], self.h[self.root]
+        right = self.add_node(root_w, 0, w, root_h)
+        self.root = self.add_node(0, 0, root_w + w, root_h, right=right, down=self.root)
+        node = self.find_node(w, h)
+        return self.split_node(node, w, h) if node != -1 else None
 
     def grow_down(self, w: int, h: int) -> Union[Dict, None]:
-        self.root = {
-            'used': True,
-            'x': 0,
-            'y': 0,
-            'w': self.root['w'],
-            'h': self.root['h'] + h,
-            'down': {'x': 0, 'y': self.root['h'], 'w': self.root['w'], 'h': h},
-            'right': self.root
-        }
-        node = self.find_node(self.root, w, h)
-        return self.split_node(node, w, h) if node else None
-    
-### Sable Tweaks
-class AlignmentNode():
-    def __init__(self, x: int, y: int, vA: int) -> None:
-        self.x = x
-        self.y = y
-        # Vertical Allowance
-        self.vA = vA
+        root_w, root_h = self.w[self.root], self.h[self.root]
+        down = self.add_node(0, root_h, root_w, h)
+        self.root = self.add_node(0, 0, root_w, root_h + h, right=self.root, down=down)
+        node = self.find_node(w, h)
+        return self.split_node(node, w, h) if node != -1 else None
 
 
-class SableBinPacker(object):
-    images = {}
-    atlasWidth = 0
-    atlasHeight = 0
-    nodesDictionary = {}
-    nodesArray = []
-    growDirection = 1
+class MaxRectsPacker(object):
+    heuristics = ('BSSF', 'BAF', 'BL')
 
-    validAtlasSizes = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192]
+    def __init__(self, images: Dict, heuristic: str = 'BSSF', rotate: bool = False) -> None:
+        self.bin = images
+        self.heuristic = heuristic
+        self.rotate = rotate
+        self.free_rects = []
 
-    def __init__(self, images: Dict) -> None:
-        self.images = images
+    def fit(self) -> Dict:
+        if not self.bin:
+            return self.bin
 
-        self.nodesDictionary = {} # <int (y), AlignmentNode>
-        self.nodesArray = []
+        sizes = [img['gfx']['size'] for img in self.bin.values()]
+        width, height = self.get_initial_size(sizes)
+        fits = self.pack(sizes, width, height)
+        while fits is None:
+            if width <= height:
+                width += max(1, math.ceil(width / 32))
+            else:
+                height += max(1, math.ceil(height / 32))
+            fits = self.pack(sizes, width, height)
+
+        for img, fit in zip(self.bin.values(), fits):
+            img['gfx']['fit'] = fit
+        return self.bin
 
-        self.atlasWidth = 0
-        self.atlasHeight = 0
+    def get_initial_size(self, sizes: List[Tuple[float, float]]) -> Tuple[float, float]:
+        side = math.ceil(math.sqrt(sum(w * h for w, h in sizes)))
+        if self.rotate:
+            return (max(side, max(min(w, h) for w, h in sizes)),) * 2
+        return max(side, max(w for w, _ in sizes)), max(side, max(h for _, h in sizes))
+
+    def pack(self, sizes: List[Tuple[float, float]], width: float, height: float) -> Union[List[Dict], None]:
+        self.reset(width, height)
+        fits = []
+
+        for w, h in sizes:
+            fit = self.insert(w, h)
+            if not fit:
+                return None
+            fits.append(fit)
+
+        return fits
+
+    def reset(self, width: float, height: float) -> None:
+        self.free_rects = [(0, 0, width, height)]
+
+    def insert(self, w: float, h: float) -> Union[Dict, None]:
+        rect = self.find_position(w, h)
+        if not rect:
+            return None
+
+        self.place_rect(rect)
+        fit = {'x': rect[0], 'y': rect[1], 'w': w, 'h': h}
+        if (rect[2], rect[3]) != (w, h):
+            fit['rotated'] = True
+        return fit
+
+    def find_position(self, w: float, h: float) -> Union[Rect, None]:
+        best_score = None
+        best_rect = None
+        orientations = [(w, h), (h, w)] if self.rotate and w != h else [(w, h)]
+
+        for free_rect in self.free_rects:
+            for rect_w, rect_h in orientations:
+                if rect_w > free_rect[2] or rect_h > free_rect[3]:
+                    continue
+                score = self.score(free_rect, rect_w, rect_h)
+                if best_score is None or score < best_score:
+                    best_score = score
+                    best_rect = (free_rect[0], free_rect[1], rect_w, rect_h)
+
+        return best_rect
+
+    def score(self, free_rect: Rect, w: float, h: float) -> Tuple[float, float]:
+        x, y, free_w, free_h = free_rect
+        leftover_x = free_w - w
+        leftover_y = free_h - h
+        short_side, long_side = sorted((leftover_x, leftover_y))
+
+        if self.heuristic == 'BAF':
+            return free_w * free_h - w * h, short_side
+        elif self.heuristic == 'BL':
+            return y + h, x
+        return short_side, long_side
+
+    def place_rect(self, used: Rect) -> None:
+        kept_rects = []
+        new_rects = []
+
+        for free_rect in self.free_rects:
+            if self.intersects(free_rect, used):
+                new_rects.extend(self.split_free_rect(free_rect, used))
+            else:
+                kept_rects.append(free_rect)
+
+        new_rects = [
+            rect for idx, rect in enumerate(new_rects)
+            if not any(self.contains(other, rect) for other in kept_rects) and
+            not any(self.contains(other, rect) and (other != rect or other_idx < idx)
+                    for other_idx, other in enumerate(new_rects) if other_idx != idx)
+        ]
+        kept_rects = [rect for rect in kept_rects if not any(self.contains(other, rect) for other in new_rects)]
+        self.free_rects = kept_rects + new_rects
 
-        # if > 0, then grow atlas horizontally, if < 0, then grow vertically
-        self.growDirection = 1
+    @staticmethod
+    def split_free_rect(free_rect: Rect, used: Rect) -> List[Rect]:
+        x, y, w, h = free_rect
+        used_x, used_y, used_w, used_h = used
+        rects = []
+
+        if used_y > y:
+            rects.append((x, y, w, used_y - y))
+        if used_y + used_h < y + h:
+            rects.append((x, used_y + used_h, w, y + h - used_y - used_h))
+        if used_x > x:
+            rects.append((x, y, used_x - x, h))
+        if used_x + used_w < x + w:
+            rects.append((used_x + used_w, y, x + w - used_x - used_w, h))
+
+        return rects
 
-    def fit(self) -> Dict:
+    @staticmethod
+    def intersects(a: Rect, b: Rect) -> bool:
+        return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
 
-        if not self.images:
-            return self.images        
+    @staticmethod
+    def contains(a: Rect, b: Rect) -> bool:
+        return a[0] <= b[0] and a[1] <= b[1] and b[0] + b[2] <= a[0] + a[2] and b[1] + b[3] <= a[1] + a[3]
 
-        '''tempDictionary = {}
-        iterationCount = 0
-        for key, img in self.images.items():
-            iterationCount += 1 
 
-            tempDictionary[key] = img
+class PowerOfTwoPacker(object):
+    def __init__(self, images: Dict, rotate: bool = False, square: bool = False, max_size: int = 16384) -> None:
+        self.bin = images
+        self.rotate = rotate
+        self.square = square
+        self.max_size = max_size
 
-            if iterationCount >= 30:
-                break            
+    def fit(self) -> Dict:
+        if not self.bin:
+            return self.bin
 
-        self.images = tempDictionary'''
+        sizes = [img['gfx']['size'] for img in self.bin.values()]
+        for width, height in self.get_candidates(sizes):
+            for heuristic in MaxRectsPacker.heuristics:
+                fits = MaxRectsPacker({}, heuristic, self.rotate).pack(sizes, width, height)
+                if fits:
+                    for img, fit in zip(self.bin.values(), fits):
+                        img['gfx']['fit'] = fit
+                    return self.bin
+
+        return MaxRectsPacker(self.bin, rotate=self.rotate).fit()
+
+    def get_candidates(self, sizes: List[Tuple[float, float]]) -> List[Tuple[int, int]]:
+        area = sum(w * h for w, h in sizes)
+        if self.rotate:
+            min_width = min_height = max(min(size) for size in sizes)
+        else:
+            min_width = max(w for w, _ in sizes)
+            min_height = max(h for _, h in sizes)
+
+        sides = [1 << i for i in range(int(self.max_size).bit_length())]
+        candidates = [
+            (width, height)
+            for width in sides if width >= min_width
+            for height in sides if height >= min_height
+            if width * height >= area and (not self.square or width == height)
+        ]
+        return sorted(candidates, key=lambda size: (size[0] * size[1], max(size), -size[0]))
+
+
+class PagePacker(object):
+    def __init__(self, images: Dict, page_size: int, heuristic: str = 'BSSF', rotate: bool = False) -> None:
+        self.bin = images
+        self.page_size = page_size
+        self.heuristic = heuristic
+        self.rotate = rotate
+        self.pages = []
 
-        print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Fitting!")  
+    def fit(self) -> Dict:
+        self.pages = []
 
-        #iterationCount = 0
-        for img in self.images.values():
+        for img in self.bin.values():
             w, h = img['gfx']['size']
-            x = 0
-            y = 0
-            
-            #iterationCount += 1         
-
-            print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Fitting Next Image: w" + str(w) + " h" + str(h))
-            img['gfx']['fit'] = {'x': x, 'y': y, 'w': w, 'h': h}
-
-            # Check to see if this is the first image
-            if self.atlasWidth == 0:           
-                for i in range(0, len(self.validAtlasSizes)):
-                    pwr2 = self.validAtlasSizes[i]
-                    if max(w, h) == pwr2:                      
-                        self.atlasWidth = pwr2
-                        self.atlasHeight = pwr2                  
-                        break
-
-                    if max(w, h) < pwr2:                    
-                        self.atlasWidth = pwr2
-                        self.atlasHeight = pwr2
-                        break
-
-                print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Setting Atlas size [w" + str(self.atlasWidth) + " h" + str(self.atlasHeight) + "]")                            
-                        
-                if self.atlasWidth == 0:
-                    print("Error: Cannot be using zero width images")
-                    break            
-
-                self.nodesArray.append(AlignmentNode(w, 0, h))
-                self.nodesArray.append(AlignmentNode(0, h, 0))
-
-                self.nodesDictionary[0] = self.nodesArray[0]
-                self.nodesDictionary[self.atlasHeight] = self.nodesArray[1]               
-
-                print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Putting " + str(w) + "x" + str(h) + " at: [x" + str(x) + " y" + str(y) + "]")
+            img['gfx']['fit'] = self.fit_image(w, h)
 
-                img['gfx']['fit'] = {'x': x, 'y': y, 'w': w, 'h': h}
-                continue
+        return self.bin
 
-            # determine what node to add this image to
-            rightmostNode = self.nodesArray[0]
-            lowestNode = self.nodesArray[-1]
-            validmostNode = None
-            for node in self.nodesArray:
-                if node.x > rightmostNode.x:
-                    rightmostNode = node
-
-                if node.y > lowestNode.y:
-                    lowestNode = node
-                
-                # vertical allowance check
-                if h > node.vA:
-                    continue
+    def fit_image(self, w: float, h: float) -> Union[Dict, None]:
+        for page_idx, page in enumerate(self.pages):
+            fit = page.insert(w, h)
+            if fit:
+                fit['page'] = page_idx
+                return fit
+
+        page = MaxRectsPacker({}, self.heuristic, self.rotate)
+        page.reset(self.page_size, self.page_size)
+        fit = page.insert(w, h)
+        if not fit:
+            return None
+
+        self.pages.append(page)
+        fit['page'] = len(self.pages) - 1
+        return fit
+
+
+class SearchPacker(object):
+    # Slow packers grow roughly quadratically with the tile count, so large tile sets only use the fast ones.
+    # No candidate starts after the time limit, and the search ends once a layout reaches the lower bound.
+    slow_packer_tiles = 250
+    time_limit = 1.5
+
+    def __init__(self, images: Dict, packers: List[Callable[[Dict], object]], get_score: Callable[[Dict], Tuple],
+                 slow_packers: Sequence[Callable[[Dict], object]] = (),
+                 get_lower_bound: Union[Callable[[Dict], Tuple], None] = None) -> None:
+        self.bin = images
+        self.packers = packers
+        self.slow_packers = slow_packers
+        self.get_score = get_score
+        self.get_lower_bound = get_lower_bound
 
-                if self.atlasWidth - node.x >= w:
-                    if self.atlasHeight - node.y >= h:
-                        if validmostNode == None:
-                            validmostNode = node
-                            continue
-
-                        if node.x > validmostNode.x:
-                            validmostNode = node
-
-            # evaluate node
-            if validmostNode == None:
-                # time to expand atalas
-                
-                if self.growDirection > 0:
-                    self.atlasWidth *= 2
-                    validmostNode = rightmostNode                    
-                else:
-                    previousHeight = self.atlasHeight
-                    self.atlasHeight *= 2
-                    lowestNode.vA = self.atlasHeight-lowestNode.y
-                    validmostNode = lowestNode
-
-                self.growDirection *= -1
-
-                #print("~~~~~~~~~~~~~~~ [Atlaser]: " + "GOT HERE 2")
-
-            print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Putting " + str(w) + "x" + str(h) + " Image at: [x" + str(validmostNode.x) + " y" + str(validmostNode.y) + "]")
-            img['gfx']['fit'] = {'x': validmostNode.x , 'y': validmostNode.y , 'w': w, 'h': h}
-
-            # Update used Node
-            print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Promoting Selected Node: [x" + str(validmostNode.x) + " y" + str(validmostNode.y) + " vA" + str(validmostNode.vA) + "] to [x" + str(validmostNode.x + w) + " y" + str(validmostNode.y) + " vA" + str(h) + "]")
-            previousVA = validmostNode.vA
-            validmostNode.vA = h
-            validmostNode.x += w            
-
-            # Create new node at bottom left of placed image if there isn't a node on the same y value as another
-            newNodeY = validmostNode.y + h
-            if newNodeY not in self.nodesDictionary:
-                print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Adding New Node: [x" + str(validmostNode.x - w) + " y" + str(newNodeY) + " vA" + str(validmostNode.vA-h) + "]")
-                newNode = AlignmentNode(validmostNode.x - w, newNodeY, previousVA-h)
-                self.nodesArray.append(newNode)
-                self.nodesDictionary[newNodeY] = newNode
-
-            # if this current node updates and is sharing the same x position of another remove itself and add its vertical allowance to it
-            for otherNode in self.nodesArray:
-                if otherNode.x == validmostNode.x and otherNode != validmostNode:
-                    #for nI in range(0, len(self.nodesArray)):
-                    #    if self.nodesArray[nI] == validmostNode:
-                    #        self.nodesArray.pop(nI)
-                    #        break
-                    print("~~~~~~~~~~~~~~~ [Atlaser]: " + "Removing Node: [x" + str(validmostNode.x) + " y" + str(validmostNode.y) + " vA" + str(validmostNode.vA) + "]")
-                    self.nodesArray.remove(validmostNode)
-                    del self.nodesDictionary[validmostNode.y]
-                    otherNode.vA += validmostNode.vA
-                    break
-
-
-
-
-
-        #w, h = img['gfx']['size']
-        #node = self.find_node(self.root, w, h)
-        #img['gfx']['fit'] = self.split_node(node, w, h) if node else self.grow_node(w, h)
+    def fit(self) -> Dict:
+        if not self.bin:
+            return self.bin
 
-        return self.images
+        best_score = None
+        best_layout = None
+        lower_bound = self.get_lower_bound(self.bin) if self.get_lower_bound else None
+        deadline = time.perf_counter() + self.time_limit
+
+        for order, packer in self.get_candidates():
+            layout = OrderedDict((key, {'gfx': {'size': self.bin[key]['gfx']['size']}}) for key in order)
+            packer(layout).fit()
+            score = self.get_score(layout)
+            if best_score is None or score < best_score:
+                best_score = score
+                best_layout = layout
+            if lower_bound is not None and best_score <= lower_bound or time.perf_counter() > deadline:
+                break
+
+        for key, img in best_layout.items():
+            self.bin[key]['gfx']['fit'] = img['gfx']['fit']
+        return OrderedDict((key, self.bin[key]) for key in best_layout)
+
+    def get_candidates(self) -> Iterator[Tuple[List, Callable[[Dict], object]]]:
+        orders = [
+            sorted(self.bin, key=lambda key: ordering(self.bin[key]['gfx']['size']), reverse=True)
+            for ordering in size_orderings.values()
+        ]
+        packers = [self.packers]
+        if len(self.bin) <= self.slow_packer_tiles:
+            packers.append(self.slow_packers)
+
+        for group in packers:
+            for order in orders:
+                for packer in group:
+                    yield order, packer
 
-    '''def find_node(self, root: Dict, w: int, h: int) -> Union[Dict, None]:
-        if 'used' in root and root['used']:
-            return self.find_node(root['right'], w, h) or self.find_node(root['down'], w, h)
-        elif w <= root['w'] and h <= root['h']:
-            return root
-        return None
 
-    @staticmethod
-    def split_node(node: Dict, w: int, h: int) -> Dict:
-        node['used'] = True
-        node['down'] = {'x': node['x'], 'y': node['y'] + h, 'w': node['w'], 'h': node['h'] - h}
-        node['right'] = {'x': node['x'] + w, 'y': node['y'], 'w': node['w'] - w, 'h': h}
-        return node
+### Sable Tweaks
+class SableBinPacker(object):
+    def __init__(self, images: Dict, rotate: bool = False, verbose: bool = True) -> None:
+        self.images = images
+        self.rotate = rotate
+        self.verbose = verbose
 
-    def grow_node(self, w: int, h: int) -> Union[Dict, None]:     
-        can_grow_right = h <= self.root['h']
-        can_grow_down = w <= self.root['w']
+        self.atlasWidth = 0
+        self.atlasHeight = 0
 
-        should_grow_right = can_grow_right and self.root['h'] >= self.root['w'] + w
-        should_grow_down = can_grow_down and self.root['w'] >= self.root['h'] + h
+        # if > 0, then grow atlas horizontally, if < 0, then grow vertically
+        self.growDirection = 1
 
-        if should_grow_right or not should_grow_down and can_grow_right:
-            return self.grow_right(w, h)
-        elif should_grow_down or can_grow_down:
-            return self.grow_down(w, h)
-        return None
+        # Skyline segments sorted by x, each one spans [x, x + width) and is filled down to y
+        self.segmentsX = []
+        self.segmentsY = []
+        self.segmentsWidth = []
 
-    def grow_right(self, w: int, h: int) -> Union[Dict, None]:
-        self.root = {
-            'used': True,
-            'x': 0,
-            'y': 0,
-            'w': self.root['w'] + w,
-            'h': self.root['h'],
-            'down': self.root,
-            'right': {'x': self.root['w'], 'y': 0, 'w': w, 'h': self.root['h']}
-        }
-        node = self.find_node(self.root, w, h)
-        return self.split_node(node, w, h) if node else None
+        self.usedArea = 0
+        self.wasteArea = 0
 
-    def grow_down(self, w: int, h: int) -> Union[Dict, None]:
-        self.root = {
-            'used': True,
-            'x': 0,
-            'y': 0,
-            'w': self.root['w'],
-            'h': self.root['h'] + h,
-            'down': {'x': 0, 'y': self.root['h'], 'w': self.root['w'], 'h': h},
-            'right': self.root
+    def fit(self) -> Dict:
+        if not self.images:
+            return self.images
+
+        for img in self.images.values():
+            w, h = img['gfx']['size']
+
+            # The first image decides the starting power of 2 square
+            if self.atlasWidth == 0:
+                self.atlasWidth = self.atlasHeight = 1 << max(int(math.ceil(max(w, h)) - 1), 0).bit_length()
+                self.segmentsX.append(0)
+                self.segmentsY.append(0)
+                self.segmentsWidth.append(self.atlasWidth)
+
+            position = self.find_rotated_position(w, h)
+            while position is None:
+                self.grow()
+                position = self.find_rotated_position(w, h)
+
+            index, x, y, rotated = position
+            if rotated:
+                self.place(index, x, y, h, w)
+                img['gfx']['fit'] = {'x': x, 'y': y, 'w': w, 'h': h, 'rotated': True}
+            else:
+                self.place(index, x, y, w, h)
+                img['gfx']['fit'] = {'x': x, 'y': y, 'w': w, 'h': h}
+
+        stats = self.get_stats()
+        if self.verbose:
+            print('~~~~~~~~~~~~~~~ [Atlaser]: Fitted {0} images into [w{1} h{2}], {3:.1%} occupied, {4:.0f}px wasted'.format(
+                len(self.images), self.atlasWidth, self.atlasHeight, stats['occupancy'], stats['waste_area']))
+        return self.images
+
+    def find_rotated_position(self, w: float, h: float) -> Union[Tuple[int, float, float, bool], None]:
+        position = self.find_position(w, h)
+        if not self.rotate or w == h:
+            return position + (False,) if position else None
+
+        rotated_position = self.find_position(h, w)
+        if rotated_position and (not position or rotated_position[2] + w < position[2] + h):
+            return rotated_position + (True,)
+        return position + (False,) if position else None
+
+    def find_position(self, w: float, h: float) -> Union[Tuple[int, float, float], None]:
+        best_position = None
+        limit = self.atlasHeight - h
+
+        for index, x in enumerate(self.segmentsX):
+            if x + w > self.atlasWidth:
+                break
+            # An image never ends up above the segment it starts on, so lower segments can't beat the best one
+            if self.segmentsY[index] > limit or best_position and self.segmentsY[index] >= best_position[2]:
+                continue
+
+            y = self.get_top(index, x + w, limit)
+            if y is not None and (best_position is None or y < best_position[2]):
+                best_position = index, x, y
+
+        return best_position
+
+    def get_top(self, index: int, right: float, limit: float) -> Union[float, None]:
+        y = self.segmentsY[index]
+        index += 1
+        while index < len(self.segmentsX) and self.segmentsX[index] < right:
+            y = max(y, self.segmentsY[index])
+            if y > limit:
+                return None
+            index += 1
+        return y
+
+    def place(self, index: int, x: float, y: float, w: float, h: float) -> None:
+        right = x + w
+        end = bisect.bisect_left(self.segmentsX, right, index)
+
+        for i in range(index, end):
+            segment_right = min(self.segmentsX[i] + self.segmentsWidth[i], right)
+            self.wasteArea += (y - self.segmentsY[i]) * (segment_right - self.segmentsX[i])
+        self.usedArea += w * h
+
+        last = end - 1
+        last_right = self.segmentsX[last] + self.segmentsWidth[last]
+        new_x, new_y, new_width = [x], [y + h], [w]
+        if last_right > right:
+            new_x.append(right)
+            new_y.append(self.segmentsY[last])
+            new_width.append(last_right - right)
+
+        self.segmentsX[index:end] = new_x
+        self.segmentsY[index:end] = new_y
+        self.segmentsWidth[index:end] = new_width
+
+        self.merge(index + len(new_x) - 1)
+        self.merge(index)
+
+    def merge(self, index: int) -> None:
+        # Joins the segment with its right neighbour when both are filled to the same height
+        if 0 <= index < len(self.segmentsX) - 1 and self.segmentsY[index] == self.segmentsY[index + 1]:
+            self.segmentsWidth[index] += self.segmentsWidth[index + 1]
+            del self.segmentsX[index + 1]
+            del self.segmentsY[index + 1]
+            del self.segmentsWidth[index + 1]
+
+    def grow(self) -> None:
+        if self.growDirection > 0:
+            self.segmentsX.append(self.atlasWidth)
+            self.segmentsY.append(0)
+            self.segmentsWidth.append(self.atlasWidth)
+            self.atlasWidth *= 2
+            self.merge(len(self.segmentsX) - 2)
+        else:
+            self.atlasHeight *= 2
+
+        self.growDirection *= -1
+
+    def get_stats(self) -> Dict[str, float]:
+        atlas_area = self.atlasWidth * self.atlasHeight
+        return {
+            'atlas_area': atlas_area,
+            'used_area': self.usedArea,
+            'waste_area': self.wasteArea,
+            'occupancy': self.usedArea / atlas_area if atlas_area else 0,
         }
-        node = self.find_node(self.root, w, h)
-        return self.split_node(node, w, h) if node else None'''
 ###
@@ -69,6 +69,13 @@ def _materials_list(scn: Scene, m_col: bpy.types.UILayout) -> None:
     col.prop(scn, 'smc_sable_create_HUDelements_texture')
     col.separator()                
     col.prop(scn, 'smc_sable_merge_by_distance_weight', text='Merge by Distance')    
+    col.prop(scn, 'smc_sable_incremental')
+    col.separator()
+    col.prop(scn, 'smc_packer')
+    col.prop(scn, 'smc_rotate')
+    col.prop(scn, 'smc_pages')
+    if scn.smc_pages != 'OFF':
+        col.prop(scn, 'smc_page_size')
     col.separator()
     ###
     col = m_col.column()
@@ -0,0 +1,116 @@
+import importlib.util
+import os
+
+import numpy as np
+
+_spec = importlib.util.spec_from_file_location(
+    'islands', os.path.join(os.path.dirname(__file__), '..', 'utils', 'islands.py'))
+islands = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(islands)
+
+
+def _get_reference_labels(count: int, edges: np.ndarray) -> np.ndarray:
+    parents = list(range(count))
+
+    def find(node: int) -> int:
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    for first, second in edges.tolist():
+        first, second = find(first), find(second)
+        if first != second:
+            parents[max(first, second)] = min(first, second)
+    return np.array([find(node) for node in range(count)])
+
+
+def test_label_components_matches_union_find() -> None:
+    rng = np.random.default_rng(1234)
+    for _ in range(300):
+        count = int(rng.integers(1, 200))
+        edges = rng.integers(0, count, (int(rng.integers(0, 300)), 2))
+        assert np.array_equal(islands.label_components(count, edges), _get_reference_labels(count, edges))
+
+
+def test_label_components_long_chain() -> None:
+    count = 200000
+    order = np.random.default_rng(1234).permutation(count)
+    edges = np.column_stack((order[:-1], order[1:]))
+    assert not islands.label_components(count, edges).any()
+
+
+def test_label_components_shuffled_grid() -> None:
+    side = 500
+    nodes = np.random.default_rng(1234).permutation(side * side).reshape(side, side)
+    edges = np.concatenate((
+        np.column_stack((nodes[:, :-1].ravel(), nodes[:, 1:].ravel())),
+        np.column_stack((nodes[:-1].ravel(), nodes[1:].ravel())),
+    ))
+    assert not islands.label_components(side * side, edges).any()
+
+
+def test_label_components_without_edges() -> None:
+    assert np.array_equal(islands.label_components(4, np.empty((0, 2), dtype=int)), np.arange(4))
+
+
+def _merge_rects_pairwise(rects: np.ndarray) -> np.ndarray:
+    rect_ids = np.arange(len(rects))
+    while True:
+        overlaps = ((rects[:, None, 0] < rects[None, :, 2]) & (rects[None, :, 0] < rects[:, None, 2]) &
+                    (rects[:, None, 1] < rects[None, :, 3]) & (rects[None, :, 1] < rects[:, None, 3]))
+        edges = np.argwhere(np.triu(overlaps, 1))
+        if not len(edges):
+            return rects[rect_ids]
+
+        _, labels = np.unique(_get_reference_labels(len(rects), edges), return_inverse=True)
+        labels = labels.ravel()
+        merged = np.array([
+            rects[labels == label, :2].min(axis=0).tolist() + rects[labels == label, 2:].max(axis=0).tolist()
+            for label in range(labels.max() + 1)
+        ])
+        rects = merged
+        rect_ids = labels[rect_ids]
+
+
+def _get_random_rects(rng: np.random.Generator, count: int, max_size: int) -> np.ndarray:
+    corners = rng.integers(0, 4096, (count, 2))
+    return np.column_stack((corners, corners + rng.integers(1, max_size, (count, 2))))
+
+
+def test_merge_rects_matches_pairwise_merge() -> None:
+    rng = np.random.default_rng(1234)
+    for count, max_size in ((3000, 24), (2000, 160), (300, 1200)):
+        rects = _get_random_rects(rng, count, max_size)
+        merged, rect_ids = islands.merge_rects(rects)
+        assert np.array_equal(merged[rect_ids], _merge_rects_pairwise(rects))
+
+
+def test_merge_rects_leaves_no_overlaps() -> None:
+    merged, _ = islands.merge_rects(_get_random_rects(np.random.default_rng(1234), 4000, 200))
+    order = np.argsort(merged[:, 0])
+    for idx, rect in enumerate(merged[order]):
+        later = merged[order[idx + 1:]]
+        assert not ((later[:, 0] < rect[2]) & (rect[1] < later[:, 3]) & (later[:, 1] < rect[3])).any()
+
+
+def test_merge_rects_in_small_batches(monkeypatch) -> None:
+    rects = _get_random_rects(np.random.default_rng(1234), 500, 300)
+    expected, expected_ids = islands.merge_rects(rects)
+    monkeypatch.setattr(islands, 'pair_batch_size', 7)
+    merged, rect_ids = islands.merge_rects(rects)
+    assert np.array_equal(merged[rect_ids], expected[expected_ids])
+
+
+def test_get_uv_islands_splits_at_seams() -> None:
+    # Two quads sharing the edge between vertices 1 and 4, 2 and 5
+    loop_vertices = np.array((0, 1, 4, 3, 1, 2, 5, 4), dtype=np.int32)
+    loop_faces = np.repeat(np.arange(2, dtype=np.int32), 4)
+    joined = np.array(((0, 0), (0.5, 0), (0.5, 1), (0, 1), (0.5, 0), (1, 0), (1, 1), (0.5, 1)), dtype=np.float32)
+    seam = joined.copy()
+    seam[4:] += 2
+    loops = np.arange(8)
+
+    assert not islands.get_uv_islands(loop_faces, loop_vertices, joined, loops).any()
+    assert islands.get_uv_islands(loop_faces, loop_vertices, seam, loops).tolist() == [0] * 4 + [1] * 4
+    assert islands.get_uv_islands(loop_faces, loop_vertices, seam, loops[4:]).tolist() == [0] * 4
@@ -0,0 +1,169 @@
+import importlib.util
+import os
+import random
+from typing import Dict
+from typing import Union
+
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    'packer', os.path.join(os.path.dirname(__file__), '..', 'operators', 'combiner', 'packer.py'))
+packer = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(packer)
+
+
+class RecursiveBinPacker(object):
+    # The dict tree implementation BinPacker replaced, kept as the reference layout
+    def __init__(self, images: Dict, rotate: bool = False) -> None:
+        self.root = {}
+        self.bin = images
+        self.rotate = rotate
+
+    def fit(self) -> Dict:
+        self.root = {'x': 0, 'y': 0, 'w': 0, 'h': 0}
+
+        if not self.bin:
+            return self.bin
+
+        self.root['w'], self.root['h'] = next(iter(self.bin.values()))['gfx']['size']
+
+        for img in self.bin.values():
+            w, h = img['gfx']['size']
+            img['gfx']['fit'] = self.fit_image(w, h)
+
+        return self.bin
+
+    def fit_image(self, w: int, h: int) -> Union[Dict, None]:
+        node = self.find_node(self.root, w, h)
+        if node:
+            return self.split_node(node, w, h)
+
+        node = self.find_node(self.root, h, w) if self.rotate else None
+        if node:
+            return self.rotate_fit(self.split_node(node, h, w))
+
+        fit = self.grow_node(w, h)
+        if not fit and self.rotate:
+            fit = self.rotate_fit(self.grow_node(h, w))
+        return fit
+
+    @staticmethod
+    def rotate_fit(fit: Union[Dict, None]) -> Union[Dict, None]:
+        if fit:
+            fit['rotated'] = True
+        return fit
+
+    def find_node(self, root: Dict, w: int, h: int) -> Union[Dict, None]:
+        if 'used' in root and root['used']:
+            return self.find_node(root['right'], w, h) or self.find_node(root['down'], w, h)
+        elif w <= root['w'] and h <= root['h']:
+            return root
+        return None
+
+    @staticmethod
+    def split_node(node: Dict, w: int, h: int) -> Dict:
+        node['used'] = True
+        node['down'] = {'x': node['x'], 'y': node['y'] + h, 'w': node['w'], 'h': node['h'] - h}
+        node['right'] = {'x': node['x'] + w, 'y': node['y'], 'w': node['w'] - w, 'h': h}
+        return node
+
+    def grow_node(self, w: int, h: int) -> Union[Dict, None]:
+        can_grow_right = h <= self.root['h']
+        can_grow_down = w <= self.root['w']
+
+        should_grow_right = can_grow_right and self.root['h'] >= self.root['w'] + w
+        should_grow_down = can_grow_down and self.root['w'] >= self.root['h'] + h
+
+        if should_grow_right or not should_grow_down and can_grow_right:
+            return self.grow_right(w, h)
+        elif should_grow_down or can_grow_down:
+            return self.grow_down(w, h)
+        return None
+
+    def grow_right(self, w: int, h: int) -> Union[Dict, None]:
+        self.root = {
+            'used': True,
+            'x': 0,
+            'y': 0,
+            'w': self.root['w'] + w,
+            'h': self.root['h'],
+            'down': self.root,
+            'right': {'x': self.root['w'], 'y': 0, 'w': w, 'h': self.root['h']}
+        }
+        node = self.find_node(self.root, w, h)
+        return self.split_node(node, w, h) if node else None
+
+    def grow_down(self, w: int, h: int) -> Union[Dict, None]:
+        self.root = {
+            'used': True,
+            'x': 0,
+            'y': 0,
+            'w': self.root['w'],
+            'h': self.root['h'] + h,
+            'down': {'x': 0, 'y': self.root['h'], 'w': self.root['w'], 'h': h},
+            'right': self.root
+        }
+        node = self.find_node(self.root, w, h)
+        return self.split_node(node, w, h) if node else None
+
+
+def _get_images(rng: random.Random) -> Dict:
+    sizes = [(rng.randint(1, 512), rng.randint(1, 512)) for _ in range(rng.randint(1, 60))]
+    if rng.random() < 0.5:
+        sizes.sort(key=lambda size: (max(size), size[0] * size[1], size[0]), reverse=True)
+    return {idx: {'gfx': {'size': size}} for idx, size in enumerate(sizes)}
+
+
+def _get_fits(images: Dict) -> Dict:
+    return {
+        idx: {key: img['gfx']['fit'][key] for key in ('x', 'y', 'w', 'h', 'rotated') if key in img['gfx']['fit']}
+        if img['gfx']['fit'] else None
+        for idx, img in images.items()
+    }
+
+
+@pytest.mark.parametrize('rotate', [False, True])
+def test_bin_packer_matches_recursive_layout(rotate: bool) -> None:
+    rng = random.Random(1234 + rotate)
+    for _ in range(500):
+        images = _get_images(rng)
+        expected = _get_fits(RecursiveBinPacker({idx: {'gfx': dict(img['gfx'])} for idx, img in images.items()},
+                                                rotate=rotate).fit())
+        assert _get_fits(packer.BinPacker(images, rotate=rotate).fit()) == expected
+
+
+def test_bin_packer_empty() -> None:
+    assert packer.BinPacker({}).fit() == {}
+
+
+def _get_search_packer(images: Dict, calls: list, lower_bound: Union[tuple, None] = None) -> 'packer.SearchPacker':
+    def get_packer(name: str):
+        def pack(layout: Dict):
+            calls.append(name)
+            return packer.BinPacker(layout)
+        return pack
+
+    return packer.SearchPacker(
+        images, [get_packer('fast')], lambda layout: (0, 0.0), slow_packers=[get_packer('slow')],
+        get_lower_bound=(lambda layout: lower_bound) if lower_bound else None)
+
+
+def test_search_packer_skips_slow_packers_for_many_tiles() -> None:
+    rng = random.Random(42)
+    sizes = [(rng.randint(1, 64), rng.randint(1, 64)) for _ in range(packer.SearchPacker.slow_packer_tiles + 1)]
+    images = {idx: {'gfx': {'size': size}} for idx, size in enumerate(sizes)}
+    calls = []
+    fitted = _get_search_packer(images, calls).fit()
+    assert set(calls) == {'fast'}
+    assert all(img['gfx']['fit'] for img in fitted.values())
+
+
+def test_search_packer_stops_at_lower_bound() -> None:
+    images = {idx: {'gfx': {'size': (32, 32)}} for idx in range(4)}
+    calls = []
+    _get_search_packer(images, calls, lower_bound=(0, 0.0)).fit()
+    assert calls == ['fast']
+
+    calls = []
+    _get_search_packer(images, calls).fit()
+    assert calls.count('slow') == calls.count('fast') == len(packer.size_orderings)
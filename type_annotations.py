@@ -5,7 +5,7 @@ from typing import Tuple
 from typing import Union
 
 import bpy
-from mathutils import Vector
+import numpy as np
 
 from . import globs
 
@@ -20,9 +20,10 @@ Scene = bpy.types.ViewLayer if globs.is_blender_2_80_or_newer else bpy.types.Sce
 SMCObDataItem = Dict[bpy.types.Material, int]
 SMCObData = Dict[str, SMCObDataItem]
 
-MatsUV = Dict[str, DefaultDict[bpy.types.Material, List[Vector]]]
+UVLoops = Tuple[np.ndarray, np.ndarray]
+MatsUV = Dict[str, DefaultDict[bpy.types.Material, List[UVLoops]]]
 
-StructureItem = Dict[str, Union[List, Dict[str, Union[Dict[str, int], Tuple, bpy.types.PackedFile, None]]]]
+StructureItem = Dict[str, Union[List, Dict[str, Union[Dict[str, int], Tuple, bpy.types.Image, None]]]]
 Structure = Dict[bpy.types.Material, StructureItem]
 
 ObMats = Union[bpy.types.bpy_prop_collection, List[bpy.types.Material]]
@@ -36,4 +37,6 @@ CombineListDataMat = Dict[str, Union[int, bool]]
 CombineListDataItem = Dict[str, Union[Dict[bpy.types.Material, CombineListDataMat], bool]]
 CombineListData = Dict[bpy.types.Object, CombineListDataItem]
 
+ImageSource = Union[str, bytes, np.ndarray]
+
 Diffuse = Union[bpy.types.bpy_prop_collection, Tuple[float, float, float], Tuple[int, int, int]]
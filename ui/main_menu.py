@@ -44,6 +44,18 @@ class MaterialMenu(bpy.types.Panel):
             box.prop(scn, 'smc_size_width')
             box.prop(scn, 'smc_size_height')
         box.scale_y = 1.2
+        box.prop(scn, 'smc_packer')
+        box.scale_y = 1.2
+        box.prop(scn, 'smc_rotate')
+        box.scale_y = 1.2
+        box.prop(scn, 'smc_islands')
+        box.scale_y = 1.2
+        box.prop(scn, 'smc_island_repeats')
+        box.scale_y = 1.2
+        box.prop(scn, 'smc_pages')
+        if scn.smc_pages != 'OFF':
+            box.prop(scn, 'smc_page_size')
+        box.scale_y = 1.2
         box.prop(scn, 'smc_crop')
         box.scale_y = 1.2
         box.prop(scn, 'smc_pixel_art')
@@ -65,6 +77,24 @@ class MaterialMenu(bpy.types.Panel):
         col.scale_y = 1.2
         col.alignment = 'RIGHT'
         col.prop(scn, 'smc_gaps', text='')
+        row = box.row()
+        col = row.column()
+        col.scale_y = 1.2
+        col.label(text='Images decoded in parallel')
+        col = row.column()
+        col.scale_x = .75
+        col.scale_y = 1.2
+        col.alignment = 'RIGHT'
+        col.prop(scn, 'smc_prefetch_limit', text='')
+        row = box.row()
+        col = row.column()
+        col.scale_y = 1.2
+        col.label(text='Decoded image cache (MB)')
+        col = row.column()
+        col.scale_x = .75
+        col.scale_y = 1.2
+        col.alignment = 'RIGHT'
+        col.prop(scn, 'smc_image_cache_size', text='')
         col = layout.column()
         col.scale_y = 1.5
         col.operator('smc.combiner', text='Save Atlas to..', icon_value=get_icon_id('null')).cats = False
@@ -1,19 +1,300 @@
+import hashlib
+import io
+import mmap
 import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import Hashable
+from typing import Iterable
+from typing import Tuple
 from typing import Union
 
 import bpy
+import numpy as np
+
+from .. import globs
+from ..type_annotations import ImageSource
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_content_hashes = {}
+_image_sizes = {}
+
+
+class DecodedImageCache(object):
+    def __init__(self, budget: int = 0) -> None:
+        self.budget = budget
+        self.images = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, source: ImageSource, draft_size: Union[Tuple[int, int], None] = None) -> 'Image.Image':
+        with self.lock:
+            img = self.images.get(key)
+            if img is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+
+        img = open_image(source, draft_size)
+        self.put(key, img)
+        return img
+
+    def put(self, key: Hashable, img: 'Image.Image') -> None:
+        size = _get_image_bytes(img)
+        with self.lock:
+            if key in self.images or size > self.budget:
+                return
+            self.images[key] = img
+            self.size += size
+            self.evict()
+
+    def set_budget(self, budget: int) -> None:
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+    def evict(self) -> None:
+        while self.size > self.budget:
+            _, img = self.images.popitem(last=False)
+            self.size -= _get_image_bytes(img)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.images.clear()
+            self.size = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'images': len(self.images),
+                'bytes': self.size,
+            }
+
+
+decoded_images = DecodedImageCache()
+
+
+def get_decoded_image(pointer: int, source: ImageSource,
+                      draft_size: Union[Tuple[int, int], None] = None) -> 'Image.Image':
+    return decoded_images.get((get_source_key(pointer, source), draft_size), source, draft_size)
 
 
 def get_image(tex: bpy.types.Texture) -> bpy.types.Image:
     return tex.image if tex and hasattr(tex, 'image') and tex.image else None
 
 
-def get_packed_file(image: Union[bpy.types.Image, None]) -> Union[bpy.types.PackedFile, None]:
-    if image and not image.packed_file and _get_image_path(image):
-        image.pack()
-    return image.packed_file if image and image.packed_file else None
+def get_source_image(image: Union[bpy.types.Image, None]) -> Union[bpy.types.Image, None]:
+    return image if image and (_is_in_memory(image) or image.packed_file or _get_image_path(image)) else None
+
+
+def read_image_source(image: bpy.types.Image) -> ImageSource:
+    # Unsaved pixels win over the file, packed data wins like it does in Blender,
+    # files on disk are read by path and never packed
+    if _is_in_memory(image):
+        return read_image_pixels(image)
+    return image.packed_file.data if image.packed_file else _get_image_path(image)
+
+
+def read_image_pixels(image: bpy.types.Image) -> np.ndarray:
+    width, height = image.size
+    pixels = np.empty(width * height * image.channels, dtype=np.float32)
+    if globs.is_blender_2_83_or_newer:
+        image.pixels.foreach_get(pixels)
+    else:
+        pixels[:] = image.pixels[:]
+
+    pixels = pixels.reshape(height, width, image.channels)[::-1]
+    if image.is_float and image.colorspace_settings.name.startswith('Linear'):
+        # Float buffers hold linear values, the atlas is saved as sRGB
+        pixels[..., :3] = _linear_to_srgb(pixels[..., :3])
+
+    rgba = np.empty((height, width, 4), dtype=np.uint8)
+    rgba[..., :3] = _to_bytes(pixels[..., :3] if image.channels >= 3 else pixels[..., :1])
+    rgba[..., 3] = _to_bytes(pixels[..., -1]) if image.channels in (2, 4) else 255
+    return rgba
+
+
+def _linear_to_srgb(pixels: np.ndarray) -> np.ndarray:
+    pixels = np.clip(pixels, 0, 1)
+    return np.where(pixels <= 0.0031308, pixels * 12.92, 1.055 * np.power(pixels, 1 / 2.4) - 0.055)
+
+
+def _to_bytes(pixels: np.ndarray) -> np.ndarray:
+    return (np.clip(pixels, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+
+def get_source_key(pointer: int, source: ImageSource) -> Hashable:
+    if not isinstance(source, str):
+        return pointer, hashlib.sha1(source).hexdigest()
+    stat = os.stat(source)
+    return pointer, source, stat.st_mtime_ns, stat.st_size
+
+
+def open_image(source: ImageSource, draft_size: Union[Tuple[int, int], None] = None) -> 'Image.Image':
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source, 'RGBA')
+    if isinstance(source, bytes):
+        return _load_image(Image.open(io.BytesIO(source)), draft_size)
+
+    with open(source, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return _load_image(Image.open(buffer), draft_size)
+
+
+def is_jpeg(source: ImageSource) -> bool:
+    if isinstance(source, np.ndarray):
+        return False
+    if isinstance(source, bytes):
+        return source[:2] == b'\xff\xd8'
+    with open(source, 'rb') as file:
+        return file.read(2) == b'\xff\xd8'
+
+
+def _load_image(img: 'Image.Image', draft_size: Union[Tuple[int, int], None]) -> 'Image.Image':
+    # Only JPEG supports draft, it decodes at the smallest DCT scale that still covers the size
+    if draft_size:
+        img.draft(img.mode, draft_size)
+    img.load()
+    return img
+
+
+def get_image_size(image: bpy.types.Image) -> Tuple[int, int]:
+    path = None if image.packed_file else _get_image_path(image)
+    if _is_in_memory(image):
+        return tuple(image.size)
+    if image.packed_file:
+        key = image.as_pointer(), image.packed_file.size, image.filepath_raw
+    elif path:
+        stat = os.stat(path)
+        key = path, stat.st_mtime_ns
+    else:
+        return tuple(image.size)
+
+    size = _image_sizes.get(key)
+    if not size:
+        extension = os.path.splitext(image.filepath_raw)[1].lower()
+        if image.packed_file:
+            size = _probe_image_size(image.packed_file.data, extension)
+        else:
+            with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                size = _probe_image_size(buffer, extension)
+        size = _image_sizes[key] = size or tuple(image.size)
+    return size
+
+
+def _probe_image_size(buffer: Union[bytes, mmap.mmap], extension: str) -> Union[Tuple[int, int], None]:
+    try:
+        if buffer[:8] == b'\x89PNG\r\n\x1a\n':
+            return struct.unpack('>II', buffer[16:24])
+        if buffer[:2] == b'\xff\xd8':
+            return _probe_jpeg_size(buffer)
+        if buffer[:4] == b'DDS ':
+            height, width = struct.unpack('<II', buffer[12:20])
+            return width, height
+        if extension == '.tga':
+            return struct.unpack('<HH', buffer[12:16])
+    except struct.error:
+        pass
+    return None
+
+
+def _probe_jpeg_size(buffer: Union[bytes, mmap.mmap]) -> Union[Tuple[int, int], None]:
+    offset = 2
+    while offset + 4 <= len(buffer):
+        if buffer[offset] != 0xff:
+            return None
+        marker = buffer[offset + 1]
+        if marker == 0xff:
+            offset += 1
+            continue
+        if marker in (0xd8, 0x01) or 0xd0 <= marker <= 0xd7:
+            offset += 2
+            continue
+
+        length = struct.unpack('>H', buffer[offset + 2:offset + 4])[0]
+        # Start of frame markers, except DHT, JPG and DAC which share the range
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            height, width = struct.unpack('>HH', buffer[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def get_content_hashes(images: Iterable[bpy.types.Image]) -> Dict[bpy.types.Image, str]:
+    hashes = {}
+    pending = {}
+
+    for image in dict.fromkeys(images):
+        token = _get_source_token(image)
+        cached = _content_hashes.get(image.as_pointer())
+        if cached and token and cached[0] == token:
+            hashes[image] = cached[1]
+        else:
+            # Packed data has to be read on the main thread, only decoding and hashing run in the pool
+            pending[image] = (image.as_pointer(), token, read_image_source(image))
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=min(len(pending), os.cpu_count() or 1)) as executor:
+            pointers, _, sources = zip(*pending.values())
+            content_hashes = executor.map(_get_content_hash, pointers, sources)
+            for (image, (key, token, _)), content_hash in zip(pending.items(), content_hashes):
+                _content_hashes[key] = (token, content_hash)
+                hashes[image] = content_hash
+
+    return hashes
+
+
+def _get_source_token(image: bpy.types.Image) -> Union[Tuple, None]:
+    if _is_in_memory(image):
+        return None
+    if image.packed_file:
+        return image.packed_file.size, image.filepath_raw
+    stat = os.stat(_get_image_path(image))
+    return image.filepath_raw, stat.st_mtime_ns, stat.st_size
+
+
+def _get_content_hash(pointer: int, source: ImageSource) -> str:
+    if Image:
+        try:
+            # Decoded through the shared cache, so the atlas pass doesn't decode the image again
+            img = get_decoded_image(pointer, source)
+            if img.mode != 'RGBA':
+                img = img.convert('RGBA')
+            content_hash = hashlib.sha1(str(img.size).encode())
+            content_hash.update(img.tobytes())
+            return content_hash.hexdigest()
+        except (OSError, ValueError):
+            pass
+
+    if not isinstance(source, str):
+        return hashlib.sha1(source).hexdigest()
+    with open(source, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def _is_in_memory(img: bpy.types.Image) -> bool:
+    # Generated, baked or painted images whose pixels only live in Blender
+    return img.source == 'GENERATED' or img.is_dirty
 
 
 def _get_image_path(img: Union[bpy.types.Image, None]) -> Union[str, None]:
     path = os.path.abspath(bpy.path.abspath(img.filepath)) if img else ''
     return path if os.path.isfile(path) and not path.lower().endswith(('.spa', '.sph')) else None
+
+
+def _get_image_bytes(img: 'Image.Image') -> int:
+    return img.width * img.height * len(img.getbands())
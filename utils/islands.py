@@ -0,0 +1,81 @@
+from typing import Tuple
+
+import numpy as np
+
+pair_batch_size = 1 << 22
+
+
+def get_uv_islands(loop_faces: np.ndarray, loop_vertices: np.ndarray, uv_data: np.ndarray,
+                   loops: np.ndarray) -> np.ndarray:
+    # Loops are the same island node when they share a vertex and the exact same UV
+    keys = np.column_stack((loop_vertices[loops], np.ascontiguousarray(uv_data[loops]).view(np.int32)))
+    _, nodes = np.unique(keys, axis=0, return_inverse=True)
+    nodes = nodes.ravel()
+
+    faces = loop_faces[loops]
+    same_face = faces[1:] == faces[:-1]
+    edges = np.column_stack((nodes[:-1][same_face], nodes[1:][same_face]))
+    _, islands = np.unique(label_components(int(nodes.max(initial=-1)) + 1, edges)[nodes], return_inverse=True)
+    return islands.ravel()
+
+
+def label_components(count: int, edges: np.ndarray) -> np.ndarray:
+    # Union-find over all edges at once: roots hook onto the smaller root of every edge that still joins
+    # two trees, then every node is compressed straight to its root before the next round
+    labels = np.arange(count)
+    edges = np.asarray(edges, dtype=labels.dtype).reshape(-1, 2)
+
+    while True:
+        roots = labels[labels]
+        while not np.array_equal(roots, labels):
+            labels = roots
+            roots = labels[labels]
+
+        first, second = labels[edges[:, 0]], labels[edges[:, 1]]
+        joining = first != second
+        if not joining.any():
+            return labels
+
+        edges = edges[joining]
+        first, second = first[joining], second[joining]
+        np.minimum.at(labels, np.maximum(first, second), np.minimum(first, second))
+
+
+def merge_rects(rects: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    rect_ids = np.arange(len(rects))
+    while True:
+        edges = _get_overlaps(rects)
+        if not len(edges):
+            return rects, rect_ids
+
+        _, labels = np.unique(label_components(len(rects), edges), return_inverse=True)
+        labels = labels.ravel()
+        merged = np.empty((labels.max() + 1, 4), dtype=rects.dtype)
+        merged[:, :2] = np.iinfo(rects.dtype).max
+        merged[:, 2:] = np.iinfo(rects.dtype).min
+        np.minimum.at(merged[:, 0], labels, rects[:, 0])
+        np.minimum.at(merged[:, 1], labels, rects[:, 1])
+        np.maximum.at(merged[:, 2], labels, rects[:, 2])
+        np.maximum.at(merged[:, 3], labels, rects[:, 3])
+        rects = merged
+        rect_ids = labels[rect_ids]
+
+
+def _get_overlaps(rects: np.ndarray) -> np.ndarray:
+    # Sort and sweep on x: only the rects that start before a rect ends can overlap it,
+    # the candidate pairs are then checked on y in batches to keep the memory bounded
+    order = np.argsort(rects[:, 0], kind='stable')
+    rects = rects[order]
+    firsts = np.arange(len(rects))
+    counts = np.maximum(np.searchsorted(rects[:, 0], rects[:, 2]) - firsts - 1, 0)
+    batch_ends = np.searchsorted(np.cumsum(counts), np.arange(1, counts.sum() // pair_batch_size + 1) * pair_batch_size)
+    edges = []
+
+    for batch in np.split(firsts, batch_ends):
+        batch_counts = counts[batch]
+        first = np.repeat(batch, batch_counts)
+        second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(batch_counts) - batch_counts, batch_counts)
+        overlaps = (rects[first, 1] < rects[second, 3]) & (rects[second, 1] < rects[first, 3])
+        edges.append(np.column_stack((order[first[overlaps]], order[second[overlaps]])))
+
+    return np.concatenate(edges)
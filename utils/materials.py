@@ -8,8 +8,9 @@ from typing import cast
 import bpy
 import numpy as np
 
+from .images import get_content_hashes
 from .images import get_image
-from .images import get_packed_file
+from .images import get_source_image
 from .textures import get_texture
 from .. import globs
 from ..type_annotations import Diffuse
@@ -74,28 +75,35 @@ def sort_materials(mat_list: List[bpy.types.Material]) -> ValuesView[MatDictItem
     for mat in bpy.data.materials:
         mat.root_mat = None
 
-    mat_dict = cast(MatDict, defaultdict(list))
-    for mat in mat_list:
-        node_tree = mat.node_tree if mat else None
-
-        packed_file = None
-
-        if globs.is_blender_2_79_or_older:
-            packed_file = get_packed_file(get_image(get_texture(mat)))
-        elif node_tree:
-            shader = get_shader_type(mat)
-            node_name = shader_image_nodes.get(shader)
-            if node_name:
-                packed_file = get_packed_file(node_tree.nodes[node_name].image)
+    images = {mat: _get_mat_source_image(mat) for mat in mat_list}
+    content_hashes = get_content_hashes(image for image in images.values() if image)
 
-        if packed_file:
-            mat_dict[(packed_file, get_diffuse(mat) if mat.smc_diffuse else None)].append(mat)
+    mat_dict = cast(MatDict, defaultdict(list))
+    for mat, image in images.items():
+        if image:
+            mat_dict[(
+                content_hashes[image],
+                get_diffuse(mat) if mat.smc_diffuse else None,
+                (mat.smc_size_width, mat.smc_size_height) if mat.smc_size else None,
+            )].append(mat)
         else:
             mat_dict[get_diffuse(mat)].append(mat)
 
     return mat_dict.values()
 
 
+def _get_mat_source_image(mat: bpy.types.Material) -> Union[bpy.types.Image, None]:
+    if globs.is_blender_2_79_or_older:
+        return get_source_image(get_image(get_texture(mat)))
+
+    node_tree = mat.node_tree if mat else None
+    if not node_tree:
+        return None
+
+    node_name = shader_image_nodes.get(get_shader_type(mat))
+    return get_source_image(node_tree.nodes[node_name].image) if node_name else None
+
+
 def rgb_to_255_scale(diffuse: Diffuse) -> Diffuse:
     rgb = np.empty(shape=(0,), dtype=int)
     for c in diffuse:
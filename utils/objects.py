@@ -1,38 +1,116 @@
-import math
-from collections import defaultdict
-from typing import List, Dict
+from typing import Dict, Tuple, Union
 
 import bpy
-from mathutils import Vector
+import numpy as np
 
 
-def get_polys(ob: bpy.types.Object) -> Dict[int, bpy.types.MeshPolygon]:
-    polys = defaultdict(list)
-    for poly in ob.data.polygons:
-        polys[poly.material_index].append(poly)
-    return polys
+_poly_indices = {}
 
 
-def get_uv(ob: bpy.types.Object, poly: bpy.types.MeshPolygon) -> List[Vector]:
+class PolyIndex(object):
+    def __init__(self, mesh: bpy.types.Mesh) -> None:
+        self.counts = (len(mesh.polygons), len(mesh.loops))
+        self.material_index = _get_poly_attribute(mesh.polygons, 'material_index')
+        self.loop_start = _get_poly_attribute(mesh.polygons, 'loop_start')
+        self.loop_total = _get_poly_attribute(mesh.polygons, 'loop_total')
+        self.groups = self._get_groups()
+        self.loop_faces = None
+        self.loop_vertices = None
+
+    def _get_groups(self) -> Dict[int, np.ndarray]:
+        order = np.argsort(self.material_index, kind='stable')
+        indices, starts = np.unique(self.material_index[order], return_index=True)
+        return {int(idx): polys for idx, polys in zip(indices, np.split(order, starts[1:]))}
+
+    def set_material_index(self, material_index: np.ndarray) -> None:
+        self.material_index = material_index
+        self.groups = self._get_groups()
+
+    def get_loop_topology(self, mesh: bpy.types.Mesh) -> Tuple[np.ndarray, np.ndarray]:
+        # Only island extraction needs these, they are read once per mesh on first use
+        if self.loop_vertices is None:
+            self.loop_faces = np.empty(len(mesh.loops), dtype=np.int32)
+            self.loop_faces[get_loop_indices(self.loop_start, self.loop_total)] = np.repeat(
+                np.arange(len(self.loop_start), dtype=np.int32), self.loop_total)
+            self.loop_vertices = np.empty(len(mesh.loops), dtype=np.int32)
+            mesh.loops.foreach_get('vertex_index', self.loop_vertices)
+        return self.loop_faces, self.loop_vertices
+
+    def is_valid(self, mesh: bpy.types.Mesh) -> bool:
+        return self.counts == (len(mesh.polygons), len(mesh.loops))
+
+
+def _get_poly_attribute(polygons: bpy.types.MeshPolygons, attr: str) -> np.ndarray:
+    values = np.empty(len(polygons), dtype=np.int32)
+    polygons.foreach_get(attr, values)
+    return values
+
+
+def get_poly_index(ob: bpy.types.Object) -> PolyIndex:
+    key = ob.data.as_pointer()
+    poly_index = _poly_indices.get(key)
+    if not poly_index or not poly_index.is_valid(ob.data):
+        poly_index = _poly_indices[key] = PolyIndex(ob.data)
+    return poly_index
+
+
+def get_loop_topology(ob: bpy.types.Object) -> Tuple[np.ndarray, np.ndarray]:
+    return get_poly_index(ob).get_loop_topology(ob.data)
+
+
+def clear_poly_index(ob: Union[bpy.types.Object, None] = None) -> None:
+    if ob is None:
+        _poly_indices.clear()
+    else:
+        _poly_indices.pop(ob.data.as_pointer(), None)
+
+
+def get_polys(ob: bpy.types.Object) -> Dict[int, np.ndarray]:
+    return get_poly_index(ob).groups
+
+
+def get_poly_loops(ob: bpy.types.Object) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    poly_index = get_poly_index(ob)
+    return {
+        idx: (poly_index.loop_start[polys], poly_index.loop_total[polys])
+        for idx, polys in poly_index.groups.items()
+    }
+
+
+def remap_material_index(ob: bpy.types.Object, mapping: Dict[int, int]) -> None:
+    poly_index = get_poly_index(ob)
+    if not mapping or not len(poly_index.material_index):
+        return
+
+    lut = np.arange(max(len(ob.data.materials), int(poly_index.material_index.max()) + 1), dtype=np.int32)
+    lut[list(mapping.keys())] = list(mapping.values())
+    material_index = lut[poly_index.material_index]
+    ob.data.polygons.foreach_set('material_index', material_index)
+    poly_index.set_material_index(material_index)
+
+
+def get_loop_indices(loop_start: np.ndarray, loop_total: np.ndarray) -> np.ndarray:
+    offsets = loop_start - np.cumsum(loop_total) + loop_total
+    return np.repeat(offsets, loop_total) + np.arange(loop_total.sum())
+
+
+def get_uv_data(ob: bpy.types.Object) -> np.ndarray:
     data = ob.data.uv_layers.active.data
-    return [data[loop_idx].uv if loop_idx < len(data) else Vector((0, 0, 0)) for loop_idx in poly.loop_indices]
+    uv_data = np.empty(len(data) * 2, dtype=np.float32)
+    data.foreach_get('uv', uv_data)
+    return uv_data.reshape(-1, 2)
 
 
-def align_uv(face_uv: List[Vector]) -> List[Vector]:
-    min_x = float('inf')
-    min_y = float('inf')
+def set_uv_data(ob: bpy.types.Object, uv_data: np.ndarray) -> None:
+    ob.data.uv_layers.active.data.foreach_set('uv', uv_data.ravel())
 
-    for uv in face_uv:
-        if not math.isnan(uv.x):
-            min_x = min(min_x, uv.x)
-        if not math.isnan(uv.y):
-            min_y = min(min_y, uv.y)
 
-    min_x = math.floor(min_x)
-    min_y = math.floor(min_y)
+def align_uv(uv_data: np.ndarray, loop_start: np.ndarray, loop_total: np.ndarray) -> np.ndarray:
+    if not len(loop_start):
+        return uv_data
 
-    if min_x != 0 or min_y != 0:
-        for uv in face_uv:
-            uv.x -= min_x
-            uv.y -= min_y
-    return face_uv
+    loops = get_loop_indices(loop_start, loop_total)
+    face_offsets = np.cumsum(loop_total) - loop_total
+    face_min = np.floor(np.fmin.reduceat(uv_data[loops], face_offsets, axis=0))
+    uv_data[loops] -= np.repeat(np.nan_to_num(face_min), loop_total, axis=0)
+    return uv_data